@@ -0,0 +1,112 @@
+"""Micro-benchmark for pyglet_piss.common.frameCachedProperty.
+
+Simulates a scene of objects whose cached properties are read several times
+per frame, and reports the time per frame along with cache hits and misses
+per frame.  The dict-based implementation that frameCachedProperty replaced
+is included for comparison.
+
+Run as:  python benchmarks/bench_framecache.py
+"""
+
+import harness
+
+import functools
+import timeit
+
+from pyglet_piss.common import frameCachedProperty
+
+OBJECTS = 200
+READS_PER_FRAME = 8
+FRAMES = 500
+
+def legacyFrameCachedProperty(f):
+    # The previous dict-based implementation, for comparison
+    cname = f.__name__
+    missing = {}
+
+    @functools.wraps(f)
+    def wrapped(self):
+        cached = getattr(self, '_frameCache__', None)
+        if cached is None:
+            cached = self._frameCache__ = {}
+
+        result = cached.get(cname, missing)
+        if result is missing:
+            cached[cname] = result = f(self)
+        return result
+    return wrapped
+def _legacyClear(self):
+    self._frameCache__ = {}
+legacyFrameCachedProperty.clear = _legacyClear
+
+
+class Counter(object):
+    misses = 0
+
+
+
+def makeClasses(counter):
+    def compute(self):
+        counter.misses += 1
+        return (self.x, self.y, self.x * 2, self.y * 2)
+
+    class Legacy(object):
+        def __init__(self):
+            self.x = 1.0
+            self.y = 2.0
+        bounds = property(legacyFrameCachedProperty(compute))
+
+    class Stacked(object):
+        def __init__(self):
+            self.x = 1.0
+            self.y = 2.0
+        bounds = property(frameCachedProperty(compute))
+
+    class Slotted(object):
+        __slots__ = ('x', 'y', '_frameCached_compute')
+        def __init__(self):
+            self.x = 1.0
+            self.y = 2.0
+        bounds = property(frameCachedProperty(compute))
+
+    return Legacy, Stacked, Slotted
+
+
+def runFrames(objs, clearEach):
+    for _ in range(FRAMES):
+        for o in objs:
+            for _ in range(READS_PER_FRAME):
+                o.bounds
+        clearEach(objs)
+
+
+def main():
+    counter = Counter()
+    Legacy, Stacked, Slotted = makeClasses(counter)
+
+    def legacyClear(objs):
+        for o in objs:
+            legacyFrameCachedProperty.clear(o)
+    def generationClear(objs):
+        frameCachedProperty.clear()
+
+    cases = [
+            ('legacy dict', Legacy, legacyClear),
+            ('generation', Stacked, generationClear),
+            ('generation (slots)', Slotted, generationClear),
+    ]
+    reads = OBJECTS * READS_PER_FRAME
+    print("{0} objects, {1} reads per object per frame, {2} frames".format(
+            OBJECTS, READS_PER_FRAME, FRAMES))
+    for name, cls, clear in cases:
+        objs = [ cls() for _ in range(OBJECTS) ]
+        counter.misses = 0
+        t = timeit.timeit(lambda: runFrames(objs, clear), number = 1)
+        misses = counter.misses / float(FRAMES)
+        print("{0:>20}: {1:8.1f} us/frame, {2:6.0f} hits/frame, "
+                "{3:6.0f} misses/frame".format(name, t / FRAMES * 1e6,
+                    reads - misses, misses))
+
+
+if __name__ == '__main__':
+    main()
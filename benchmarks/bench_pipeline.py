@@ -0,0 +1,202 @@
+"""Benchmarks for the per-frame scene / layer / input pipeline.
+
+Drives Application.update, Scene._sceneUpdate, Scene._sceneAction,
+Scene._sceneDraw (with GL calls recorded rather than issued),
+Layer.coordsLocal for every scissorMode, and action recurrence, with
+synthetic players and layer stacks of varying size.  Reports the time and
+memory per frame, so that regressions in the hot loop show up on a machine
+without a GPU or display.
+
+Run as:  python benchmarks/bench_pipeline.py [frames]
+"""
+
+import harness
+
+import sys
+
+from pyglet_piss import Actions, Layer, Layer3d, Scene, handlesAction
+from pyglet_piss.glstate import state as glState
+from pyglet_piss.player import Player
+from pyglet_piss.recurring import RecurringEngine
+
+FRAMES = 2000
+LAYER_COUNTS = (1, 10, 100)
+PLAYER_COUNTS = (1, 8)
+
+class BenchLayer(Layer):
+    def __init__(self):
+        Layer.__init__(self)
+        self.localBounds = (0, 0, 400, 300)
+        self.t = 0.0
+        self.handled = 0
+
+
+    @handlesAction(Actions.BTN1, Actions.BTN1_UP)
+    def onButton(self, player, action):
+        self.handled += 1
+
+
+    def onUpdate(self, dt):
+        self.t += dt
+
+
+
+class BenchPlayer(Player):
+    """Presses and releases BTN1 every few frames, and holds TAP_RIGHT so
+    that it recurs."""
+
+    def __init__(self):
+        Player.__init__(self)
+        self.frame = 0
+        self.startAction(Actions.TAP_RIGHT)
+
+
+    def poll(self):
+        self.frame += 1
+        if self.frame % 4 == 0:
+            self.startAction(Actions.BTN1)
+        elif self.frame % 4 == 2:
+            self.stopAction(Actions.BTN1)
+
+
+
+def makeScene(layers, cls = BenchLayer):
+    scene = Scene()
+    for _ in range(layers):
+        scene.addLayer(cls())
+    return scene
+
+
+def benchUpdate(frames):
+    print("Application.update (input routing and scene update)")
+    for layers in LAYER_COUNTS:
+        for players in PLAYER_COUNTS:
+            app = harness.makeApp([ makeScene(layers) ])
+            app.players = [ BenchPlayer() for _ in range(players) ]
+            result = harness.measure(lambda: app.update(1.0 / 60), frames)
+            harness.report('{0} layers, {1} players'.format(layers, players),
+                    *result)
+
+    # The same with a fixed timestep, two steps per tick
+    app = harness.makeApp([ makeScene(LAYER_COUNTS[-1]) ])
+    app.players = [ BenchPlayer() for _ in range(PLAYER_COUNTS[-1]) ]
+    app.fixedStep = 1.0 / 120
+    result = harness.measure(lambda: app.update(1.0 / 60), frames)
+    harness.report('fixed step, {0} layers, {1} players'.format(
+            LAYER_COUNTS[-1], PLAYER_COUNTS[-1]), *result)
+
+
+def benchSceneUpdate(frames):
+    print("Scene._sceneUpdate")
+    for layers in LAYER_COUNTS:
+        scene = makeScene(layers)
+        harness.makeApp([ scene ])
+        result = harness.measure(lambda: scene._sceneUpdate(1.0 / 60), frames)
+        harness.report('{0} layers'.format(layers), *result)
+
+    # Only the top layer updates
+    scene = makeScene(LAYER_COUNTS[-1])
+    harness.makeApp([ scene ])
+    scene._layers[-1].suspendsLower = True
+    result = harness.measure(lambda: scene._sceneUpdate(1.0 / 60), frames)
+    harness.report('{0} layers, top suspends'.format(LAYER_COUNTS[-1]),
+            *result)
+
+
+def benchSceneAction(frames):
+    print("Scene._sceneAction (BTN1 and TAP_RIGHT to every layer)")
+    player = Player()
+    for layers in LAYER_COUNTS:
+        scene = makeScene(layers)
+        harness.makeApp([ scene ])
+        def frame():
+            scene._sceneAction(player, Actions.BTN1)
+            scene._sceneAction(player, Actions.TAP_RIGHT)
+        result = harness.measure(frame, frames)
+        harness.report('{0} layers'.format(layers), *result)
+
+
+def benchSceneDraw(frames):
+    print("Scene._sceneDraw (GL recorded)")
+    gl = harness.RecordingGl().install()
+    try:
+        for layers in LAYER_COUNTS:
+            for name, cls in (('2d', BenchLayer), ('3d', Layer3d)):
+                scene = makeScene(layers, cls)
+                harness.makeApp([ scene ])
+                for i, l in enumerate(scene._layers):
+                    if i % 2:
+                        l.scissor(0, 0, 512, 384)
+                def frame():
+                    glState.nextFrame()
+                    scene._sceneDraw()
+                result = harness.measure(frame, frames)
+                gl.reset()
+                frame()
+                harness.report('{0} {1} layers'.format(layers, name), *result,
+                        extra = '{0} GL calls'.format(gl.total()))
+    finally:
+        gl.uninstall()
+
+
+def benchCoordsLocal(frames):
+    print("Layer.coordsLocal, recomputed each frame")
+    modes = (Layer.SCISSOR_STRETCH, Layer.SCISSOR_SCALE_BIG,
+            Layer.SCISSOR_SCALE_SMALL, Layer.SCISSOR_SCALE_WIDTH,
+            Layer.SCISSOR_SCALE_HEIGHT, Layer.SCISSOR_CLIP)
+    for mode in modes:
+        scene = makeScene(1)
+        harness.makeApp([ scene ])
+        layer = scene._layers[0]
+        layer.scissorMode = mode
+        if mode == Layer.SCISSOR_CLIP:
+            layer.localBounds = None
+        layer.scissor(100, 50, 640, 480)
+        def frame():
+            layer._layerInvalidateGeometry()
+            layer.coordsLocal
+        result = harness.measure(frame, frames)
+        harness.report(mode, *result)
+
+    layer.coordsLocal
+    result = harness.measure(lambda: layer.coordsLocal, frames)
+    harness.report('cached', *result)
+
+
+def benchRecurrence(frames):
+    print("Recurring action timers")
+    allActions = ([ Actions.BTN_BASE + i for i in range(5) ]
+            + [ Actions.TAP_LEFT, Actions.TAP_UP, Actions.TAP_RIGHT,
+                Actions.TAP_DOWN ])
+    for players in PLAYER_COUNTS:
+        for held in (1, len(allActions)):
+            recurring = RecurringEngine()
+            ps = [ Player() for _ in range(players) ]
+            for p in ps:
+                p.recurring = recurring
+                for a in allActions[:held]:
+                    p.startAction(a)
+            def frame():
+                recurring.update(1.0 / 60)
+                for p in ps:
+                    p.clearActions()
+            result = harness.measure(frame, frames)
+            harness.report('{0} players, {1} held'.format(players, held),
+                    *result)
+
+
+def main():
+    frames = FRAMES
+    if len(sys.argv) > 1:
+        frames = int(sys.argv[1])
+    print("{0} frames per case".format(frames))
+    benchUpdate(frames)
+    benchSceneUpdate(frames)
+    benchSceneAction(frames)
+    benchSceneDraw(frames)
+    benchCoordsLocal(frames)
+    benchRecurrence(frames)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,117 @@
+"""Benchmark for parsing INI files with pyglet_piss.lib.reprconf.
+
+Generates a large INI file of typical config values, and reports the time
+to parse it with every value evaluated through the AST builders, with the
+literal fast path in unrepr() (with an empty and with a warm memo), and
+from a pyglet_piss.config.loadIni() snapshot.  The cost of unrepr() alone,
+without ConfigParser, is reported as well.
+
+Run as:  python benchmarks/bench_unrepr.py [sections] [keys per section]
+"""
+
+import harness
+
+import os
+import random
+import shutil
+import sys
+import tempfile
+import timeit
+
+from pyglet_piss.config import loadIni
+from pyglet_piss.lib import reprconf
+
+SECTIONS = 200
+KEYS = 50
+REPEAT = 5
+
+def makeIni(fname, sections, keys):
+    rnd = random.Random(1)
+    values = [
+            lambda: str(rnd.randint(-1000, 1000)),
+            lambda: repr(rnd.random() * 100),
+            lambda: repr('key_' + str(rnd.randint(0, 50))),
+            lambda: rnd.choice([ 'True', 'False', 'None' ]),
+            lambda: repr([ rnd.randint(0, 9) for _ in range(4) ]),
+            lambda: repr((rnd.random(), rnd.random())),
+    ]
+    with open(fname, 'w') as f:
+        for s in range(sections):
+            f.write('[section_{0}]\n'.format(s))
+            for k in range(keys):
+                f.write('key_{0} = {1}\n'.format(k, rnd.choice(values)()))
+            f.write('\n')
+
+
+def parse(fname):
+    return reprconf.Parser().dict_from_file(fname)
+
+
+def report(baseline, results):
+    for name, t in results:
+        print("{0:>24}: {1:8.2f} ms ({2:5.1f}x)".format(name, t * 1e3,
+                baseline / t))
+
+
+def timeBest(f):
+    return min(timeit.repeat(f, number = 1, repeat = REPEAT))
+
+
+def main():
+    sections = SECTIONS
+    keys = KEYS
+    if len(sys.argv) > 1:
+        sections = int(sys.argv[1])
+    if len(sys.argv) > 2:
+        keys = int(sys.argv[2])
+
+    tmpDir = tempfile.mkdtemp()
+    try:
+        fname = os.path.join(tmpDir, 'bench.ini')
+        makeIni(fname, sections, keys)
+        print("{0} sections x {1} keys = {2} values".format(sections, keys,
+                sections * keys))
+
+        fastUnrepr = reprconf.unrepr
+        reprconf.unrepr = reprconf._unrepr_ast
+        try:
+            expected = parse(fname)
+            tAst = timeBest(lambda: parse(fname))
+        finally:
+            reprconf.unrepr = fastUnrepr
+
+        def cold():
+            reprconf._memo.clear()
+            parse(fname)
+        tCold = timeBest(cold)
+        tWarm = timeBest(lambda: parse(fname))
+        if parse(fname) != expected:
+            raise AssertionError("Fast path changed the parsed values")
+
+        loadIni(fname)
+        tSnapshot = timeBest(lambda: loadIni(fname))
+
+        print("Parsing the file")
+        report(tAst, [ ('ast only', tAst), ('fast path, cold memo', tCold),
+                ('fast path, warm memo', tWarm),
+                ('loadIni snapshot', tSnapshot) ])
+
+        raw = reprconf.Parser()
+        raw.read(fname)
+        strings = [ raw.get(s, k) for s in raw.sections()
+                for k in raw.options(s) ]
+        tAst = timeBest(lambda: [ reprconf._unrepr_ast(v) for v in strings ])
+        def cold():
+            reprconf._memo.clear()
+            [ reprconf.unrepr(v) for v in strings ]
+        tCold = timeBest(cold)
+        tWarm = timeBest(lambda: [ reprconf.unrepr(v) for v in strings ])
+        print("unrepr() of every value")
+        report(tAst, [ ('ast only', tAst), ('fast path, cold memo', tCold),
+                ('fast path, warm memo', tWarm) ])
+    finally:
+        shutil.rmtree(tmpDir)
+
+
+if __name__ == '__main__':
+    main()
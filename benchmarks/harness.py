@@ -0,0 +1,147 @@
+"""Shared helpers for the pyglet_piss benchmarks.
+
+Everything here runs without a display or GPU: pyglet's shadow window is
+disabled, windows are plain objects with a width and height, and the GL
+functions used by pyglet_piss may be swapped for a recorder that only counts
+calls.  Import this module before pyglet_piss.
+"""
+
+import os, sys
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if BASE_DIR not in sys.path:
+    sys.path.insert(0, BASE_DIR)
+
+import gc
+import timeit
+
+try:
+    import tracemalloc
+except ImportError:
+    # Python 2; allocations are not reported
+    tracemalloc = None
+
+import pyglet
+# No display needed; don't let pyglet.gl create its hidden shadow window
+pyglet.options['shadow_window'] = False
+
+import pyglet.gl
+
+import pyglet_piss.glstate
+import pyglet_piss.layer
+import pyglet_piss.layer3d
+import pyglet_piss.scene
+from pyglet_piss.app import Application, _ApplicationWindow
+
+class RecordingGl(object):
+    """Stands in for the pyglet.gl module.  Constants (GL_*) and types
+    (GLfloat etc) are the real ones; every gl* function only counts its
+    calls.  Install with install(), undo with uninstall()."""
+
+    def __init__(self):
+        self.calls = {}
+        self._saved = []
+
+
+    def __getattr__(self, name):
+        if not name.startswith('gl'):
+            return getattr(pyglet.gl, name)
+        calls = self.calls
+        def record(*args):
+            calls[name] = calls.get(name, 0) + 1
+        setattr(self, name, record)
+        return record
+
+
+    def install(self):
+        """Route pyglet_piss's GL calls through this recorder."""
+        for module in (pyglet_piss.glstate, pyglet_piss.layer,
+                pyglet_piss.scene):
+            self._saved.append((module, 'gl', getattr(module, 'gl', None)))
+            module.gl = self
+        # layer3d uses from pyglet.gl import *
+        module = pyglet_piss.layer3d
+        for name in dir(module):
+            if name.startswith('gl') and name != 'glState':
+                self._saved.append((module, name, getattr(module, name)))
+                setattr(module, name, getattr(self, name))
+        pyglet_piss.glstate.state.reset()
+        return self
+
+
+    def reset(self):
+        self.calls.clear()
+
+
+    def total(self):
+        return sum(self.calls.values())
+
+
+    def uninstall(self):
+        for module, name, value in reversed(self._saved):
+            setattr(module, name, value)
+        del self._saved[:]
+
+
+
+class FakeWindow(object):
+    """Enough of a pyglet Window for _ApplicationWindow."""
+
+    def __init__(self, width = 1024, height = 768):
+        self.width = width
+        self.height = height
+
+
+    def clear(self, *args, **kwargs):
+        pass
+
+
+
+def makeApp(scenes, width = 1024, height = 768):
+    """Returns a new Application (not the module-level instance) with one
+    fake window per scene in scenes."""
+    app = Application()
+    for scene in scenes:
+        app._windows.append(_ApplicationWindow(app, FakeWindow(width, height),
+                scene))
+    return app
+
+
+def measure(f, frames, warmup = 10):
+    """Call f() frames times after warmup calls, and return (seconds per
+    call, bytes retained per call, peak bytes allocated above the starting
+    point).  The memory figures are None where tracemalloc is unavailable."""
+    for _ in range(warmup):
+        f()
+
+    gcEnabled = gc.isenabled()
+    gc.disable()
+    try:
+        t = timeit.timeit(f, number = frames)
+    finally:
+        if gcEnabled:
+            gc.enable()
+
+    retained = peak = None
+    if tracemalloc is not None:
+        tracemalloc.start()
+        try:
+            start = tracemalloc.get_traced_memory()[0]
+            for _ in range(frames):
+                f()
+            current, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        retained = (current - start) / float(frames)
+        peak -= start
+    return t / frames, retained, peak
+
+
+def report(name, seconds, retained, peak, extra = ''):
+    """Print one result line."""
+    if retained is None:
+        memory = '(no tracemalloc)'
+    else:
+        memory = '{0:7.0f} B/frame retained, {1:7d} B peak'.format(retained,
+                peak)
+    print("{0:>36}: {1:9.1f} us/frame, {2} {3}".format(name, seconds * 1e6,
+            memory, extra).rstrip())
@@ -6,7 +6,9 @@ sys.path.insert(0, BASE_DIR)
 import pyglet
 import pyglet_piss
 
-from pyglet_piss import Actions
+from pyglet.gl import GL_QUADS
+
+from pyglet_piss import Actions, handlesAction
 
 image = pyglet.image.create(32, 32, pyglet.image.SolidColorImagePattern(
         color = (255,0,0,255)))
@@ -26,11 +28,16 @@ class GameScene(pyglet_piss.Scene):
 
 
 class CubeLayer(pyglet_piss.Layer3d):
+    SQUARE = (0, 0, 0,  0, 100, 0,  100, 100, 0,  100, 0, 0)
     
     def __init__(self):
         pyglet_piss.Layer3d.__init__(self)
         self.x = 0.0
         self.y = 0.0
+        # Geometry is uploaded once; we only move the meshes afterwards
+        self.near = self.addMesh(self.SQUARE, mode = GL_QUADS)
+        self.far = self.addMesh(self.SQUARE, mode = GL_QUADS)
+        self.placeMeshes()
         
     def onAction(self, player, action):
         if action == Actions.TAP_LEFT:
@@ -41,30 +48,19 @@ class CubeLayer(pyglet_piss.Layer3d):
             self.y += 30
         elif action == Actions.TAP_DOWN:
             self.y -= 30
+        self.placeMeshes()
             
         # Prevent onAction from being called in GameScene
         return True
-    
-    def onDraw3d(self):
-        # Draw a 3d square at x, y
-        from pyglet.gl import *
-        glTranslatef(self.x, self.y, -100)
-        glBegin(GL_QUADS)
-        glVertex3f(0, 0, 0)
-        glVertex3f(0, 100, 0)
-        glVertex3f(100, 100, 0)
-        glVertex3f(100, 0, 0)
-        glEnd()
-        glTranslatef(self.x, 0, -300)
-        glBegin(GL_QUADS)
-        glVertex3f(0, 0, 0)
-        glVertex3f(0, 100, 0)
-        glVertex3f(100, 100, 0)
-        glVertex3f(100, 0, 0)
-        glEnd()
         
     def onUpdate(self, dt):
         self.x += dt * 9.0
+        self.placeMeshes()
+        
+    def placeMeshes(self):
+        # Draw a 3d square at x, y, and another further back
+        self.near.x, self.near.y, self.near.z = self.x, self.y, -100
+        self.far.x, self.far.y, self.far.z = self.x * 2, self.y, -400
     
 
 class PlayerLayer(pyglet_piss.Layer):
@@ -73,25 +69,25 @@ class PlayerLayer(pyglet_piss.Layer):
     
     def __init__(self):
         pyglet_piss.Layer.__init__(self)
-        self.label = pyglet.text.Label("LABEL", x = 0, y = 0)
+        self.labels = {}
     
-    def onAction(self, player, action):
-        if action == Actions.BTN1:
-            self.quitScene()
-        elif action == Actions.BTN2:
-            self.suspendsLower = True
-        elif action == Actions.BTN2_UP:
-            self.suspendsLower = False
-        else:
-            return False
+    @handlesAction(Actions.BTN1)
+    def onQuit(self, player, action):
+        self.quitScene()
+        return True
+
+    @handlesAction(Actions.BTN2, Actions.BTN2_UP)
+    def onPause(self, player, action):
+        self.suspendsLower = (action == Actions.BTN2)
         return True
             
     def onDraw(self):
+        # Labels are created once per player and drawn with the layer's batch
         px = 0
         for p in self.players:
-            self.label.x = px
-            self.label.text = "Player " + str(p.id)
-            self.label.draw()
+            if p.id not in self.labels:
+                self.labels[p.id] = self.addLabel("Player " + str(p.id),
+                        x = px, y = 0)
             px += 100
 
 
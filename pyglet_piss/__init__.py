@@ -4,7 +4,7 @@ players on one machine, e.g. arcade games)
 
 from pyglet_piss.app import instance as app
 from pyglet_piss.actions import Actions
-from pyglet_piss.layer import Layer
+from pyglet_piss.layer import Layer, handlesAction
 from pyglet_piss.layer3d import Layer3d
 from pyglet_piss.config import Config
 from pyglet_piss.scene import Scene
@@ -0,0 +1,101 @@
+
+import array
+import time
+
+try:
+    now = time.perf_counter
+except AttributeError:
+    # Python 2
+    now = time.time
+
+class ActionQueue(object):
+    """A compact queue of (action, timestamp, playerId) records, stored in
+    parallel arrays that are reused from frame to frame rather than
+    reallocated.  Iterating the queue yields just the action codes, so it
+    may be used anywhere a list of actions was used before.
+
+    For allocation-free access to the full records, index the actions,
+    timestamps, and playerIds arrays directly; only the first len(queue)
+    entries of each are valid.
+    """
+
+    def __init__(self, playerId = -1, capacity = 16):
+        self.playerId = playerId
+        self.playerId_doc = """Player id recorded for appended actions that
+                do not specify one"""
+        self.actions = array.array('i', [ 0 ]) * capacity
+        self.actions_doc = """Action code for each record"""
+        self.timestamps = array.array('d', [ 0.0 ]) * capacity
+        self.timestamps_doc = """Time (from actionqueue.now()) at which each
+                record's action happened"""
+        self.playerIds = array.array('i', [ 0 ]) * capacity
+        self.playerIds_doc = """Id of the player that issued each record"""
+        self._capacity = capacity
+        self._length = 0
+
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += self._length
+        if i < 0 or i >= self._length:
+            raise IndexError("ActionQueue index out of range")
+        return self.actions[i]
+
+
+    def __iter__(self):
+        actions = self.actions
+        for i in range(self._length):
+            yield actions[i]
+
+
+    def __len__(self):
+        return self._length
+
+
+    def append(self, action, timestamp = None, playerId = None):
+        """Queue action.  timestamp defaults to now, and playerId to the
+        queue's playerId."""
+        i = self._length
+        if i == self._capacity:
+            self._grow(i + 1)
+        self.actions[i] = action
+        self.timestamps[i] = now() if timestamp is None else timestamp
+        self.playerIds[i] = self.playerId if playerId is None else playerId
+        self._length = i + 1
+
+
+    def clear(self):
+        """Forget all queued records, keeping the storage for reuse."""
+        self._length = 0
+
+
+    def extend(self, other):
+        """Append all of the records in ActionQueue other."""
+        n = other._length
+        if n == 0:
+            return
+        i = self._length
+        if i + n > self._capacity:
+            self._grow(i + n)
+        self.actions[i:i + n] = other.actions[:n]
+        self.timestamps[i:i + n] = other.timestamps[:n]
+        self.playerIds[i:i + n] = other.playerIds[:n]
+        self._length = i + n
+
+
+    def records(self):
+        """Yields (action, timestamp, playerId) for each queued record."""
+        for i in range(self._length):
+            yield (self.actions[i], self.timestamps[i], self.playerIds[i])
+
+
+    def _grow(self, needed):
+        """Double our capacity until at least needed records fit."""
+        capacity = self._capacity * 2 or 1
+        while capacity < needed:
+            capacity *= 2
+        extra = capacity - self._capacity
+        self.actions.extend(array.array('i', [ 0 ]) * extra)
+        self.timestamps.extend(array.array('d', [ 0.0 ]) * extra)
+        self.playerIds.extend(array.array('i', [ 0 ]) * extra)
+        self._capacity = capacity
@@ -25,7 +25,9 @@ class Actions(object):
             "recurred" at RECURRING_INTERVAL.  For instance, when you press
             an arrow key on the keyboard, after a little bit, applications act
             like the arrow key is being pressed more times.  This creates that
-            behavior."""
+            behavior.  These are the defaults; timings may be set per action
+            with Application.recurring, or the [recurring] config
+            section."""
     RECURRING_INTERVAL = 0.1 # seconds
     RECURRING_MINIMUM = 0.5 # seconds before recurring
     
\ No newline at end of file
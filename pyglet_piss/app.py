@@ -1,9 +1,34 @@
 
-from pyglet_piss.player import JoystickPlayer, KeyboardPlayer
-
+from pyglet_piss.actionqueue import ActionQueue, now
+from pyglet_piss.actions import Actions
+from pyglet_piss.common import frameCachedProperty
+from pyglet_piss.config import Config, DELETED
+from pyglet_piss.glstate import state as glState
+from pyglet_piss.joysticks import JoystickManager
+from pyglet_piss.player import KeyboardPlayer, Player
+from pyglet_piss.profiler import Profiler
+from pyglet_piss.recurring import RecurringEngine
+from pyglet_piss.replay import Recorder, Replay
+
+import logging
 import pyglet
 import six
 
+_log = logging.getLogger(__name__)
+
+class _OffscreenWindow(object):
+    """Stands in for a pyglet Window when nothing is displayed."""
+
+    def __init__(self, width, height):
+        self.width = width
+        self.height = height
+
+
+    def clear(self, *args, **kwargs):
+        pass
+
+
+
 class _ApplicationWindow(object):
     @property
     def app(self):
@@ -25,9 +50,24 @@ class _ApplicationWindow(object):
         return self._window
 
 
-    def __init__(self, app, window, scene):
+    def __init__(self, app, window, scene, targetFps = None):
         self._app = app
         self._window = window
+        self.targetFps = targetFps
+        self.targetFps_doc = """Rate at which to draw this window, or None to
+                draw at every opportunity.  Overridden by the top scene's
+                targetFps, if set."""
+        self.frameTime = 0.0
+        self.frameTime_doc = """Seconds that the last draw of this window
+                took, including the buffer flip"""
+        self.framesDrawn = 0
+        self.framesDrawn_doc = """Number of times this window was drawn"""
+        self.framesSkipped = 0
+        self.framesSkipped_doc = """Number of times this window was due to be
+                drawn, but its scene had redrawOnChange set and had not
+                changed"""
+        self._nextDraw = 0.0
+        self._profileKey = 'window{0}.draw'.format(len(app._windows))
         self._scenes = [ scene ]
         scene._sceneInit(self)
 
@@ -45,11 +85,62 @@ class _ApplicationWindow(object):
         if len(self._scenes) == 0:
             return
 
-        self._scenes[-1]._sceneDraw()
+        self._scenes[-1]._sceneDraw(self._app.profiler)
+
+
+    def onExpose(self):
+        if self._scenes:
+            self._scenes[-1].invalidate()
+
+
+    def onResize(self, width, height):
+        for s in self._scenes:
+            s._sceneResize(self._window.width, self._window.height)
 
 
     def removeScene(self, scene):
         self._scenes.remove(scene)
+        if self._scenes:
+            self._scenes[-1].invalidate()
+
+
+    def _windowDrawIfDue(self, t):
+        """Draw this window if it is due at time t (from actionqueue.now()).
+        Returns the seconds until it is next due, or None if it may be drawn
+        at every opportunity."""
+        scene = None
+        fps = self.targetFps
+        if self._scenes:
+            scene = self._scenes[-1]
+            if scene.targetFps is not None:
+                fps = scene.targetFps
+
+        interval = None
+        if fps:
+            interval = 1.0 / fps
+            if t < self._nextDraw:
+                return self._nextDraw - t
+            # Keep to our own cadence, but never burst to catch up
+            self._nextDraw += interval
+            if self._nextDraw <= t:
+                self._nextDraw = t + interval
+
+        if scene is None or (scene.redrawOnChange and not scene._sceneInvalid):
+            self.framesSkipped += 1
+            return interval
+
+        w = self._window
+        start = now()
+        w.switch_to()
+        glState.switchContext(w.context)
+        w.dispatch_event('on_draw')
+        w.flip()
+        glState.nextFrame()
+        self.frameTime = now() - start
+        self.framesDrawn += 1
+        if self._app.profiler is not None:
+            self._app.profiler.record(self._profileKey, self.frameTime)
+        return interval
 
 
 
@@ -57,6 +148,31 @@ class Application(object):
     """Main pyglet_piss application object.  Handles input and layers.
     """
 
+    @property
+    def actionsGenerated(self):
+        """Returns the total number of actions generated by all players,
+        including those since removed."""
+        return self._actionsGeneratedRemoved + sum(p.actionsGenerated
+                for p in self.players)
+
+
+    @property
+    def players(self):
+        """Returns the players whose actions are routed.  Assigning a new
+        list hands each of them our recurring engine."""
+        return self._players
+
+
+    @players.setter
+    def players(self, players):
+        for p in self._players:
+            if p not in players:
+                self._actionsGeneratedRemoved += p.actionsGenerated
+        for p in players:
+            p.recurring = self.recurring
+        self._players = players
+
+
     @property
     def screens(self):
         """Returns a list of screens available on this computer.  E.g., if there
@@ -73,8 +189,88 @@ class Application(object):
         """Constructor for the instance singleton.  User code entrypoint is run().
         """
         self._windows = []
-        self.players = []
+        self.recurring = RecurringEngine()
+        self.recurring_doc = """The pyglet_piss.recurring.RecurringEngine that
+                times held actions of this application's players"""
+        self._players = []
+        self._actionsGeneratedRemoved = 0
+        self._actionsGeneratedRemoved_doc = """actionsGenerated of players
+                that have left self.players, so that the totals still
+                balance after a player is removed"""
         self.conf = None
+        self.fixedStep = None
+        self.fixedStep_doc = """Seconds per simulation step when running with a
+                fixed timestep, or None to update once per rendered frame with
+                a variable dt.  Set from [loop] fixedUpdateHz in run()."""
+        self.maxStepsPerTick = 5
+        self.maxStepsPerTick_doc = """Maximum number of fixed simulation steps
+                run to catch up in a single tick; any further backlog is
+                dropped so that a slow frame cannot snowball."""
+        self._fixedAccumulator = 0.0
+        self.actionsDispatched = 0
+        self.actionsDispatched_doc = """Total number of player actions routed
+                to scenes.  Together with actionsCoalesced and
+                actionsOverflowed, should always equal actionsGenerated."""
+        self.actionsCoalesced = 0
+        self.actionsCoalesced_doc = """Total number of redundant actions
+                dropped before dispatch: repeated starts of an action within
+                one frame with no stop in between, and stops of actions that
+                were not held.  A release and press within one frame are
+                both kept."""
+        self.actionsOverflowed = 0
+        self.actionsOverflowed_doc = """Total number of actions dropped because
+                a player exceeded maxActionsPerFrame"""
+        self.maxActionsPerFrame = 64
+        self.maxActionsPerFrame_doc = """Most actions dispatched per player per
+                frame, or None for no limit.  Beyond it, starts are dropped
+                (stops of held actions still go through, so nothing sticks).
+                Set from [input] maxActionsPerFrame in run()."""
+        self.joysticks = None
+        self.joysticks_doc = """The pyglet_piss.joysticks.JoystickManager that
+                adds and removes joystick players (and the keyboard players
+                standing in for them) as devices come and go"""
+        self.watcher = None
+        self.watcher_doc = """The pyglet_piss.watcher.ConfigWatcher reloading
+                changed config files, if [config] watch is set"""
+        self._playersRemoved = []
+        self._playersRemoved_doc = """Players passed to removePlayer(), which
+                leave self.players at the end of the frame"""
+        self._heldActions = {}
+        self._heldActions_doc = """{ player id: set of actions whose start
+                was dispatched and not yet stopped }"""
+        self.actionTime = 0.0
+        self.actionTime_doc = """While an action is being dispatched, the
+                time (from actionqueue.now()) at which it happened, which
+                is more precise than the frame it is delivered in."""
+        self._actionQueue = ActionQueue()
+        self._actionQueue_doc = """This frame's actions from all players, in
+                the order that they will be dispatched"""
+        self._playersById = {}
+        self.frameIndex = 0
+        self.frameIndex_doc = """Number of update() calls so far; during
+                update(), the index of the current frame (the first is 1)"""
+        self.headless = False
+        self.headless_doc = """True if running without a display; see run()"""
+        self._exiting = False
+        self._exiting_doc = """Set by exit(); ends a headless run"""
+        self.profiler = None
+        self.profiler_doc = """A pyglet_piss.profiler.Profiler recording the
+                time taken by each phase of each frame, or None (the default)
+                to skip all timing.  Set from the [profile] section in run()."""
+
+
+    def addPlayer(self, player):
+        """Add player, whose actions are routed from the next frame on."""
+        player.recurring = self.recurring
+        self.players.append(player)
+
+
+    def exit(self):
+        """Close all windows and leave run() (or replay()) at the end of the
+        current frame."""
+        self._exiting = True
+        if not self.headless:
+            pyglet.app.exit()
 
 
     def onKeyDown(self, key, modifiers):
@@ -85,7 +281,7 @@ class Application(object):
         if key == pyglet.window.key.ESCAPE:
             # Rather than closing just the active window (may be more than
             # one!), close all windows and exit the application.
-            pyglet.app.exit()
+            self.exit()
             return pyglet.event.EVENT_HANDLED
 
 
@@ -95,20 +291,269 @@ class Application(object):
                 p._onRelease(key, modifiers)
 
 
+    def removePlayer(self, player):
+        """Remove player.  Any actions it holds are stopped, and the stops
+        dispatched in the current (or next) frame, before it is removed."""
+        for action in list(self._heldActions.get(player.id, ())):
+            player.stopAction(action)
+        self.recurring.forget(player)
+        player.recurring = None
+        self._playersRemoved.append(player)
+
+
+    def replay(self, config, fname, *scenes):
+        """Replay input recorded with startRecording() from fname, against a
+        new window for each of scenes (as run()).  Nothing is displayed;
+        each recorded frame is fed through update() with its recorded dt,
+        as fast as possible, and drawing is skipped.  Window sizes come from
+        the [display] section.  Returns the pyglet_piss.replay.Replay."""
+        self.conf = config
+        self.headless = True
+        self._createWindows(scenes)
+
+        r = Replay(fname)
+        r.play(self)
+        return r
+
+
     def run(self, config, *scenes, **kwargs):
         """config -- A pyglet_piss.Config instance, representing a section'd
         INI file.
 
         scenes - A list of scenes.  One window will be created per scene
                 specified!
+
+        headless - If True (or [display] headless is set), run without a
+                display: no windows are opened and nothing is drawn, but
+                players, scenes and layers are updated exactly as usual,
+                one frame after another as fast as possible.  Only keyboard
+                players are created, and they receive no key events unless
+                driven by code.  Layers are told the window size from
+                [display] width and height.  pyglet must not create its
+                shadow window, so set PYGLET_SHADOW_WINDOW=0 in the
+                environment (or pyglet.options['shadow_window'] = False
+                before importing pyglet_piss).
+
+        The optional [display] section sets up windows:
+            fullscreen, width, height - The size of each window.
+            targetFps - Rate at which to draw each window; either one number
+                    for all windows or a list with one per scene.  A
+                    scene's own targetFps takes precedence.  By default,
+                    windows are drawn at every opportunity, as pyglet does.
+            updateHz - Rate at which to poll input and update scenes.
+                    Defaults to the highest window rate if every window has
+                    one, otherwise every opportunity.
+            headless - See above.
+            headlessFps - When headless, frames are updated with a simulated
+                    dt of 1 / headlessFps seconds (default 60).
+            headlessFrames - When headless, exit after this many frames
+                    (default: run until exit() or a window runs out of
+                    scenes).
+
+        The optional [loop] section configures the update loop:
+            fixedUpdateHz - If set, scenes and layers are updated in fixed
+                    steps of 1 / fixedUpdateHz seconds, decoupled from the
+                    render rate.
+            maxStepsPerTick - Cap on catch-up steps per tick (default 5).
+
+        The optional [input] section:
+            maxActionsPerFrame - Cap on actions dispatched per player per
+                    frame (default 64); see self.maxActionsPerFrame.
+
+        The optional [joysticks] section:
+            rescanInterval - Seconds between checks for joysticks being
+                    connected or disconnected (default 2; 0 disables).
+
+        The optional [config] section:
+            watch - If True, files merged into config by name are reloaded
+                    when they change, while running (see
+                    pyglet_piss.watcher).  Changes to [display] width,
+                    height, fullscreen and targetFps, and to the key
+                    bindings in [keyboard_player_*] sections, take effect
+                    at the start of the next frame.
+            watchInterval - Seconds between checks for changed files when
+                    inotify is unavailable (default 1).
+
+        The optional [recurring] section sets how held actions recur; see
+        pyglet_piss.recurring.RecurringEngine.configure().
+
+        The optional [replay] section:
+            recordFile - If set, all player input is recorded to this file
+                    (see startRecording()).
+
+        The optional [profile] section turns on per-phase timing:
+            enabled - If True, set self.profiler to a new Profiler.
+            samples - Recent samples kept per phase (default 600).
+            dumpFile - If set, p50/p95/p99 times per phase are written to
+                    this file when the application exits.
         """
         self.conf = config
 
+        dispConfig = config.get('display', {})
+        self.headless = kwargs.pop('headless', dispConfig.get('headless',
+                False))
+
+        profileConfig = config.get('profile', {})
+        if profileConfig.get('enabled', False):
+            self.profiler = Profiler(profileConfig.get('samples', 600))
+
+        loopConfig = config.get('loop', {})
+        fixedHz = loopConfig.get('fixedUpdateHz')
+        if fixedHz:
+            self.fixedStep = 1.0 / fixedHz
+            self.maxStepsPerTick = loopConfig.get('maxStepsPerTick',
+                    self.maxStepsPerTick)
+
+        self.recurring.configure(config.get('recurring', {}))
+        self.maxActionsPerFrame = config.get('input', {}).get(
+                'maxActionsPerFrame', self.maxActionsPerFrame)
+
+        self._createWindows(scenes)
+        self._createPlayers()
+
+        recordFile = config.get('replay', {}).get('recordFile')
+        if recordFile:
+            self.startRecording(recordFile)
+        watchConfig = config.get('config', {})
+        if watchConfig.get('watch', False) and isinstance(config, Config):
+            from pyglet_piss.watcher import ConfigWatcher
+            self.watcher = ConfigWatcher(config,
+                    watchConfig.get('watchInterval', 1.0))
+            config.subscribe(self._onConfigChanged)
+            self.watcher.start()
+        failed = True
+        try:
+            if self.headless:
+                self._runHeadless(1.0 / dispConfig.get('headlessFps', 60),
+                        dispConfig.get('headlessFrames'))
+            else:
+                self._runWindows(dispConfig.get('updateHz'))
+            failed = False
+        finally:
+            self.stopRecording()
+            self.joysticks.stop()
+            if self.watcher is not None:
+                self.watcher.stop()
+                config.unsubscribe(self._onConfigChanged)
+            # Finish any background saves, e.g. of high scores
+            if isinstance(self.conf, Config):
+                try:
+                    self.conf.flush()
+                except Exception:
+                    if not failed:
+                        raise
+                    # Don't hide the exception that is already on its way out
+                    _log.exception("Background config save failed")
+
+        dumpFile = profileConfig.get('dumpFile')
+        if self.profiler is not None and dumpFile:
+            self.profiler.dump(dumpFile)
+
+
+    def startRecording(self, fname):
+        """Start recording every player's actions, and each frame's dt, to
+        fname; see pyglet_piss.replay.  Replay with replay()."""
+        self.stopRecording()
+        Player.recorder = Recorder(fname, self.players)
+
+
+    def stopRecording(self):
+        """Stop recording started by startRecording(), if any."""
+        if Player.recorder is not None:
+            Player.recorder.close()
+            Player.recorder = None
+
+
+    def update(self, dt):
+        self.frameIndex += 1
+        # A new frame for frameCachedProperty values, even when nothing is
+        # drawn (headless runs and replays)
+        frameCachedProperty.clear()
+
+        if self.watcher is not None:
+            # Changed config files; subscribers (e.g. _onConfigChanged) run
+            # from here, at the frame boundary
+            self.watcher.apply()
+
+        # Input loop - look for new actions, map them, and reset
+        for w in self._windows:
+            if len(w._scenes) == 0:
+                self.exit()
+                return
+
+        self._routeActions(dt)
+        if Player.recorder is not None:
+            # Every action delivered this frame has been recorded by now
+            Player.recorder.frame(self.frameIndex, dt)
+
+        if self.fixedStep is None:
+            self._updateScenes(dt)
+            return
+
+        # Fixed timestep - run zero or more whole steps of simulation, and
+        # leave the remainder for the next tick.  Layers interpolate between
+        # the last two steps using updateAlpha when drawing.
+        step = self.fixedStep
+        self._fixedAccumulator += dt
+        steps = 0
+        while self._fixedAccumulator >= step:
+            if steps >= self.maxStepsPerTick:
+                # Too far behind; drop the backlog rather than spending ever
+                # more time catching up
+                self._fixedAccumulator %= step
+                break
+            self._updateScenes(step)
+            self._fixedAccumulator -= step
+            steps += 1
+
+        alpha = self._fixedAccumulator / step
+        for w in self._windows:
+            w._scenes[-1].updateAlpha = alpha
+
+
+    def _createPlayers(self):
+        """Create players from the [keyboard_player_*] config sections and
+        any joysticks (none when headless), and start watching for joysticks
+        being connected or disconnected."""
+        # Any keyboard players?
+        possibleKeyboards = []
+        for k, mappings in six.iteritems(self.conf):
+            if k.startswith('keyboard_player_'):
+                if mappings.get('replaceWithJoystick', True):
+                    # Will be defined as joystick player, if possible
+                    possibleKeyboards.append(mappings)
+                    continue
+                # Keyboard player definition
+                self.addPlayer(KeyboardPlayer(mappings))
+
+        self.joysticks = JoystickManager(self, possibleKeyboards)
+        keys, joysticks = [], []
+        if not self.headless:
+            keys, joysticks = self.joysticks.scan()
+        self.joysticks.sync(keys, joysticks)
+
+        joyConfig = self.conf.get('joysticks', {})
+        interval = joyConfig.get('rescanInterval', 2.0)
+        if interval and not self.headless:
+            self.joysticks.start(interval)
+
+
+    def _createWindows(self, scenes):
+        """Create a window for each scene; offscreen stand-ins when
+        headless."""
+        dispConfig = self.conf.get('display', {})
+        if self.headless:
+            width = dispConfig.get('width', 1024)
+            height = dispConfig.get('height', 768)
+            for scene in scenes:
+                self._windows.append(_ApplicationWindow(self,
+                        _OffscreenWindow(width, height), scene))
+            return
+
         myDisp = pyglet.window.get_platform().get_default_display()
         screens = myDisp.get_screens()
 
         for i, scene in enumerate(scenes):
-            dispConfig = config.get('display', {})
             fullscreen = dispConfig.get('fullscreen', False)
             screen = screens[i % len(screens)]
             if fullscreen:
@@ -118,65 +563,221 @@ class Application(object):
                 width = dispConfig.get('width', 1024)
                 height = dispConfig.get('height',
                         int(width * screen.height / screen.width))
+            targetFps = self._targetFps(dispConfig, i)
             w = pyglet.window.Window(width = width, height = height,
                     fullscreen = fullscreen, screen = screen)
-            aw = _ApplicationWindow(self, w, scene)
+            aw = _ApplicationWindow(self, w, scene, targetFps)
             self._windows.append(aw)
 
             w.set_handler('on_draw', aw.onDraw)
+            w.set_handler('on_expose', aw.onExpose)
+            w.set_handler('on_resize', aw.onResize)
             w.set_handler('on_key_press', self.onKeyDown)
             w.set_handler('on_key_release', self.onKeyUp)
-        pyglet.clock.schedule(self.update)
-
-        # Any keyboard players?
-        joysticks = pyglet.input.get_joysticks()
-        possibleKeyboards = []
-        for k, mappings in six.iteritems(self.conf):
-            if k.startswith('keyboard_player_'):
-                replaceWithJoystick = mappings.pop('replaceWithJoystick', True)
-                if replaceWithJoystick:
-                    # Will be defined as joystick player, if possible
-                    possibleKeyboards.append(mappings)
-                    continue
-                # Keyboard player definition
-                self.players.append(KeyboardPlayer(mappings))
-
-        # Do we need to add the possibles?
-        usePossibles = len(possibleKeyboards) - len(joysticks)
-        while usePossibles > 0:
-            next = possibleKeyboards.pop(0)
-            self.players.append(KeyboardPlayer(next))
-            usePossibles -= 1
-
-        # Set up joystick players
-        for j in joysticks:
-            self.players.append(JoystickPlayer(j))
-        pyglet.app.run()
 
 
-    def update(self, dt):
-        # Input loop - look for new actions, map them, and reset
-        inputScenes = self._windows
-        for w in inputScenes:
-            if len(w._scenes) == 0:
-                pyglet.app.exit()
-                return
-
+    def _gatherActions(self, player, queue):
+        """Append player's actions for this frame to queue, dropping
+        redundant ones and enforcing maxActionsPerFrame."""
+        held = self._heldActions.get(player.id)
+        if held is None:
+            held = self._heldActions[player.id] = set()
+        started = set()
+        src = player.actions
+        actions = src.actions
+        timestamps = src.timestamps
+        playerId = player.id
+        cap = self.maxActionsPerFrame
+        stopMask = Actions.ACTION_STOP_MASK
+        n = len(src)
+        kept = 0
+        coalesced = 0
+        overflowed = 0
+        i = 0
+        while i < n:
+            action = actions[i]
+            if action & stopMask:
+                base = action & ~stopMask
+                if base not in held:
+                    coalesced += 1
+                    i += 1
+                    continue
+                held.discard(base)
+                started.discard(base)
+            elif action in started:
+                # Started again without a stop in between; a stop and
+                # restart within the frame is a tap, and is kept
+                coalesced += 1
+                i += 1
+                continue
+            elif cap is not None and kept >= cap:
+                overflowed += 1
+                i += 1
+                continue
+            else:
+                held.add(action)
+                started.add(action)
+            queue.append(action, timestamps[i], playerId)
+            kept += 1
+            i += 1
+
+        self.actionsCoalesced += coalesced
+        self.actionsOverflowed += overflowed
+        player.actionsOverflowed += overflowed
+
+
+    def _onConfigChanged(self, config, section, changes):
+        """Apply changed config values (reloaded by self.watcher) that can
+        change while running."""
+        if section.startswith('keyboard_player_'):
+            mappings = config.get(section)
+            for p in self.players:
+                if (isinstance(p, KeyboardPlayer) and p.mappings is not None
+                        and getattr(p.mappings, 'name', None) == section):
+                    if mappings is None or len(mappings) == 0:
+                        continue
+                    # Release everything held under the old bindings, or
+                    # their keys' releases would map to different actions
+                    for action in list(self._heldActions.get(p.id, ())):
+                        p.stopAction(action)
+                    try:
+                        p.setMappings(mappings)
+                    except ValueError as e:
+                        # A typo in the file must not stop the game; keep
+                        # the old bindings
+                        _log.warning("Ignoring [%s]: %s", section, e)
+        elif section == 'display' and not self.headless:
+            self._windowsReconfigure(config.get('display', {}), changes)
+
+
+    def _routeActions(self, dt):
+        """The input routing stage.  Polls every player and gathers their
+        actions into a single per-frame queue, then drains that queue exactly
+        once, offering each action to the windows' top scenes in order.
+        """
+        profiler = self.profiler
+        if profiler is not None:
+            t0 = now()
+
+        queue = self._actionQueue
+        playersById = self._playersById
+        playersById.clear()
+        recurring = self.recurring
         for player in self.players:
+            playersById[player.id] = player
+            # Players may also be appended to self.players directly
+            player.recurring = recurring
             player.poll()
             player.update(dt)
+        # One pass over every player's held actions, dropping any of
+        # players that are no longer ours
+        recurring.update(dt, self.players)
+        for player in self.players:
+            if len(player.actions):
+                self._gatherActions(player, queue)
+                player.clearActions()
 
-            for action in player.actions:
-                # Each action must be consumable / stoppable by a True value
-                # being returned from a handler.  We have ordered our windows
-                # in preference of handling events, so go until we get a True
-                for w in inputScenes:
-                    if w._scenes[-1]._sceneAction(player, action) is True:
-                        break
-
-            player.clearActions()
+        if profiler is not None:
+            t1 = now()
+            profiler.record('input.poll', t1 - t0)
 
+        inputScenes = self._windows
+        actions = queue.actions
+        timestamps = queue.timestamps
+        playerIds = queue.playerIds
+        n = len(queue)
+        for i in range(n):
+            player = playersById[playerIds[i]]
+            action = actions[i]
+            self.actionTime = timestamps[i]
+            # Each action must be consumable / stoppable by a True value
+            # being returned from a handler.  We have ordered our windows
+            # in preference of handling events, so go until we get a True
+            for w in inputScenes:
+                if w._scenes and w._scenes[-1]._sceneAction(player,
+                        action) is True:
+                    break
+
+        self.actionsDispatched += n
+        queue.clear()
+
+        if self._playersRemoved:
+            for player in self._playersRemoved:
+                self.players.remove(player)
+                self._actionsGeneratedRemoved += player.actionsGenerated
+                self._heldActions.pop(player.id, None)
+            del self._playersRemoved[:]
+
+        if profiler is not None:
+            profiler.record('input.dispatch', now() - t1)
+
+
+    def _runHeadless(self, dt, frames = None):
+        """Update every dt simulated seconds, as fast as possible, until
+        exit() or until frames frames have run."""
+        while not self._exiting:
+            if frames is not None and self.frameIndex >= frames:
+                break
+            self.update(dt)
+
+
+    def _runWindows(self, updateHz = None):
+        """Run pyglet's event loop, drawing each window at its own rate (see
+        pyglet_piss.scheduler), and updating at updateHz."""
+        # Imported here so that headless runs never need pyglet.app
+        from pyglet_piss.scheduler import WindowScheduler
+
+        if updateHz is None:
+            rates = []
+            for w in self._windows:
+                fps = w.targetFps
+                if w._scenes and w._scenes[-1].targetFps is not None:
+                    fps = w._scenes[-1].targetFps
+                rates.append(fps)
+            if rates and all(rates):
+                updateHz = max(rates)
+        if updateHz:
+            pyglet.clock.schedule_interval(self.update, 1.0 / updateHz)
+        else:
+            pyglet.clock.schedule(self.update)
+
+        loop = WindowScheduler(self)
+        # So that pyglet.app.exit() stops our loop
+        pyglet.app.event_loop = loop
+        loop.run()
+
+
+    def _targetFps(self, dispConfig, i):
+        """Returns [display] targetFps for window i."""
+        targetFps = dispConfig.get('targetFps')
+        if isinstance(targetFps, (list, tuple)):
+            targetFps = targetFps[i] if i < len(targetFps) else None
+        return targetFps
+
+
+    def _updateScenes(self, dt):
+        """Update the top scene of each window by dt."""
+        profiler = self.profiler
         for w in self._windows:
-            w._scenes[-1]._sceneUpdate(dt)
+            w._scenes[-1]._sceneUpdate(dt, profiler)
+
+
+    def _windowsReconfigure(self, dispConfig, changes):
+        """Apply changes to [display] to the open windows."""
+        for i, aw in enumerate(self._windows):
+            w = aw.window
+            if 'targetFps' in changes:
+                aw.targetFps = self._targetFps(dispConfig, i)
+            if 'fullscreen' in changes:
+                fullscreen = changes['fullscreen']
+                w.set_fullscreen(fullscreen is not DELETED
+                        and bool(fullscreen))
+            if not w.fullscreen and ('fullscreen' in changes
+                    or 'width' in changes or 'height' in changes):
+                # Leaving fullscreen restores the size from before it, which
+                # the reloaded size replaces
+                w.set_size(dispConfig.get('width') or w.width,
+                        dispConfig.get('height') or w.height)
+            aw.onExpose()
 
 instance = Application()
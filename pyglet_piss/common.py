@@ -1,22 +1,65 @@
 
 import functools
+import math
+
+def ortho2d(left, right, bottom, top):
+    """Returns the column-major 4x4 matrix, as a 16-tuple of floats, that
+    gluOrtho2D(left, right, bottom, top) would multiply onto the current
+    matrix.  Pure Python, so it may be computed without a GL context."""
+    w = float(right - left)
+    h = float(top - bottom)
+    return (2.0 / w, 0.0, 0.0, 0.0,
+            0.0, 2.0 / h, 0.0, 0.0,
+            0.0, 0.0, -1.0, 0.0,
+            -(right + left) / w, -(top + bottom) / h, 0.0, 1.0)
+
+
+def perspective(fovy, aspect, near, far):
+    """Returns the column-major 4x4 matrix, as a 16-tuple of floats, that
+    gluPerspective(fovy, aspect, near, far) would multiply onto the current
+    matrix."""
+    f = 1.0 / math.tan(math.radians(fovy) * 0.5)
+    depth = float(near - far)
+    return (f / aspect, 0.0, 0.0, 0.0,
+            0.0, f, 0.0, 0.0,
+            0.0, 0.0, (far + near) / depth, -1.0,
+            0.0, 0.0, 2.0 * far * near / depth, 0.0)
+
+
+_frameGeneration = [ 0 ]
 
 def frameCachedProperty(f):
-    # Decorates a property getter, that clears out every frame
-    cname = f.__name__
-    missing = {}
+    """Decorates a property getter, beneath @property, whose result should be
+    computed at most once per frame:
+
+        @property
+        @frameCachedProperty
+        def foo(self): ...
+
+    Returns a plain getter function, so that reads cost no more than any
+    other property.  Each instance keeps its cached value in an attribute
+    named _frameCached_<getter name> (add that name to __slots__ on slotted
+    classes), holding [ generation, value ].  A value is valid while its
+    generation matches the global frame generation, so clearing every cache
+    is a single integer increment rather than an allocation.
+    """
+    slot = '_frameCached_' + f.__name__
 
     @functools.wraps(f)
-    def wrapped(self):
-        cached = getattr(self, '_frameCache__', None)
-        if cached is None:
-            cached = self._frameCache__ = {}
-
-        result = cached.get(cname, missing)
-        if result is missing:
-            cached[cname] = result = f(self)
-        return result
-    return wrapped
-def __clearFrameCached(self):
-    self._frameCache__ = {}
+    def getter(obj, generation = _frameGeneration):
+        entry = getattr(obj, slot, None)
+        if entry is not None and entry[0] == generation[0]:
+            return entry[1]
+
+        if entry is None:
+            entry = [ 0, None ]
+            setattr(obj, slot, entry)
+        entry[1] = f(obj)
+        entry[0] = generation[0]
+        return entry[1]
+    return getter
+def __clearFrameCached(obj = None):
+    """Invalidates all frame-cached values.  obj is accepted for
+    compatibility; since the generation is global, it is ignored."""
+    _frameGeneration[0] += 1
 frameCachedProperty.clear = __clearFrameCached
@@ -1,8 +1,276 @@
 
 from pyglet_piss.lib.reprconf import Config as _reprConfig
+from pyglet_piss.lib.reprconf import Parser as _reprParser
 
+import atexit
+import hashlib
+import os
+import pickle
 import six
+import tempfile
+import threading
 
+try:
+    from collections.abc import MutableMapping
+except ImportError:
+    # Python 2
+    from collections import MutableMapping
+
+SNAPSHOT_VERSION = 1
+
+_IMMUTABLE_TYPES = (bool, float, complex, bytes) + six.integer_types \
+        + six.string_types
+
+# Read once, at import, since reading it means setting it
+_umask = os.umask(0)
+os.umask(_umask)
+
+class _Deleted(object):
+    def __repr__(self):
+        return 'DELETED'
+    
+    
+DELETED = _Deleted()
+DELETED_doc = """Value passed to Config subscribers for keys that no longer
+        exist; also held in a section's local overlay to hide a key that is
+        still in a merged source"""
+
+
+def _isImmutable(value):
+    """Returns True if value cannot be changed in place: a number, string,
+    None, or a tuple or frozenset of such."""
+    if isinstance(value, (tuple, frozenset)):
+        return all(_isImmutable(v) for v in value)
+    return value is None or isinstance(value, _IMMUTABLE_TYPES)
+    
+    
+def loadIni(fname, snapshot = True):
+    """Parse INI file fname to a { section: { key: value } } dict, as
+    reprconf would.
+    
+    If snapshot, the parsed result is kept in a pickle beside the file
+    (fname + Config.SNAPSHOT_SUFFIX), keyed by the SHA-1 of the file's
+    contents.  Later loads of unchanged contents skip parsing and unrepr
+    entirely; any edit to the file invalidates its snapshot.  Snapshots that
+    cannot be written (read-only directory, values that cannot be pickled)
+    are silently skipped.
+    """
+    with open(fname, 'rb') as f:
+        data = f.read()
+    if not snapshot:
+        return _parseIni(data, fname)
+    
+    digest = hashlib.sha1(data).hexdigest()
+    snapName = fname + Config.SNAPSHOT_SUFFIX
+    try:
+        with open(snapName, 'rb') as f:
+            version, snapDigest, result = pickle.load(f)
+        if version == SNAPSHOT_VERSION and snapDigest == digest:
+            return result
+    except Exception:
+        # Missing, stale, or unreadable; reparse
+        pass
+    
+    result = _parseIni(data, fname)
+    try:
+        _writeAtomic(snapName, pickle.dumps((SNAPSHOT_VERSION, digest,
+                result), pickle.HIGHEST_PROTOCOL))
+    except Exception:
+        pass
+    return result
+    
+    
+def _parseIni(data, fname):
+    parser = _reprParser()
+    if six.PY2:
+        f = six.StringIO(data)
+        parser.readfp(f, fname)
+    else:
+        # readfp() is gone as of Python 3.12
+        f = six.StringIO(data.decode('utf-8'))
+        parser.read_file(f, fname)
+    return parser.as_dict()
+    
+    
+def _replace(src, dst):
+    """Rename src over dst, atomically where the platform allows."""
+    replace = getattr(os, 'replace', None)
+    if replace is not None:
+        replace(src, dst)
+        return
+    # Python 2; rename() only replaces atomically on POSIX
+    if os.name == 'nt' and os.path.exists(dst):
+        os.remove(dst)
+    os.rename(src, dst)
+    
+    
+def _writeAtomic(fname, data):
+    """Write bytes data to fname through a temporary file in the same
+    directory, so that fname always holds either its old or its new contents,
+    never part of them.  fname keeps its permissions, or if new, gets those
+    that open() would have given it."""
+    try:
+        mode = os.stat(fname).st_mode & 0o7777
+    except OSError:
+        mode = 0o666 & ~_umask
+    fd, tmpName = tempfile.mkstemp(prefix = os.path.basename(fname),
+            dir = os.path.dirname(os.path.abspath(fname)))
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        # mkstemp() creates the file readable by its owner only
+        os.chmod(tmpName, mode)
+        _replace(tmpName, fname)
+    except Exception:
+        os.remove(tmpName)
+        raise
+    
+    
+    
+class _Writer(object):
+    """Writes files on a background thread.  Writes requested while an
+    earlier one to the same file is still waiting replace it, so only the
+    latest contents of each file are written.  Pending writes are flushed at
+    interpreter exit."""
+    
+    def __init__(self):
+        self._lock = threading.Condition()
+        self._pending = {}
+        self._pending_doc = """{ fname: bytes } waiting to be written"""
+        self._writing = False
+        self._error = None
+        self._thread = None
+        
+        
+    def flush(self):
+        """Wait until everything requested so far is written, then raise the
+        first error from any of those writes, if there was one."""
+        with self._lock:
+            while self._pending or self._writing:
+                self._lock.wait()
+            error, self._error = self._error, None
+        if error is not None:
+            raise error
+        
+        
+    def write(self, fname, data):
+        with self._lock:
+            self._pending[fname] = data
+            if self._thread is None:
+                self._thread = threading.Thread(target = self._threadMain,
+                        name = 'pyglet_piss config writer')
+                self._thread.daemon = True
+                self._thread.start()
+                atexit.register(self.flush)
+            self._lock.notify_all()
+            
+            
+    def _threadMain(self):
+        while True:
+            with self._lock:
+                while not self._pending:
+                    self._lock.wait()
+                pending, self._pending = self._pending, {}
+                self._writing = True
+            try:
+                for fname, data in six.iteritems(pending):
+                    try:
+                        _writeAtomic(fname, data)
+                    except Exception as e:
+                        with self._lock:
+                            if self._error is None:
+                                self._error = e
+            finally:
+                with self._lock:
+                    self._writing = False
+                    self._lock.notify_all()
+    
+    
+    
+
+class Section(MutableMapping):
+    """One section of a Config.  Holds a stack of overlays - the Config's
+    local overlay (written by Config.set(), or by assigning to the section)
+    on top, then each merged source, newest first - and reads from a
+    flattened copy that is rebuilt only after the section is touched.
+    
+    Deleting a key hides it even if a merged source still has it, until a
+    later merge supplies it again.
+    """
+    
+    def __init__(self, config, name, maps):
+        self.config = config
+        self.name = name
+        self.maps = maps
+        self.maps_doc = """Overlays for this section, searched in order; the
+                first is the local overlay"""
+        self._flat = None
+        self._text = None
+        self._text_doc = """This section as saved by Config.save(), or None if
+                changed since"""
+        
+        
+    def __delitem__(self, key):
+        self.config.unset(self.name, key)
+        
+        
+    def __getitem__(self, key):
+        flat = self._flat
+        if flat is None:
+            flat = self.flat()
+        return flat[key]
+        
+        
+    def __iter__(self):
+        flat = self._flat
+        if flat is None:
+            flat = self.flat()
+        return iter(flat)
+        
+        
+    def __len__(self):
+        flat = self._flat
+        if flat is None:
+            flat = self.flat()
+        return len(flat)
+        
+        
+    def __repr__(self):
+        return 'Section({0!r}, {1!r})'.format(self.name, self.flat())
+        
+        
+    def __setitem__(self, key, value):
+        self.config.set(self.name, key, value)
+        
+        
+    def copy(self):
+        """Returns a plain dict of this section's current values."""
+        return dict(self.flat())
+        
+        
+    def flat(self):
+        """Returns the (cached) flattened dict of this section.  Do not
+        modify it."""
+        flat = self._flat
+        if flat is None:
+            flat = {}
+            for m in reversed(self.maps):
+                flat.update(m)
+            for k, v in six.iteritems(self.maps[0]):
+                if v is DELETED:
+                    del flat[k]
+            self._flat = flat
+        return flat
+        
+        
+    def _sectionTouched(self):
+        self._flat = None
+        self._text = None
+    
+    
+    
 class Config(_reprConfig):
     """Extension of reprconf that allows saving back to the last file specified
     in an update() call.
@@ -17,36 +285,289 @@ class Config(_reprConfig):
     c.merge({ defaults })
     c.merge('game.ini')
     c.merge('game_local.ini')
+    
+    Files merged by name are loaded through loadIni(), so unchanged files
+    are read from a snapshot rather than parsed again.
+    
+    save() writes through a temporary file, so a crash never leaves a
+    partly written file, and only serializes sections changed since the
+    last save.  With background set, the write happens on a writer thread;
+    call flush() to wait for it.
+    
+    Merged sources are not copied into each other; each section is a
+    Section, a stack of overlays, so a merge costs only as much as the new
+    source, and unmerge() can take a source back out.  Values set with
+    set() (or by assigning into a section) go to a local overlay above all
+    sources, so they outlive later changes to other keys; the last write to
+    a key still wins, since merge() replaces the local values of the keys it
+    brings, and reload() those of the keys whose values changed.
+    subscribe() registers for notification of exactly which keys changed.
     """      
     
+    SNAPSHOT_SUFFIX = '.snapshot'
+    SNAPSHOT_SUFFIX_doc = """Appended to an INI file's name to name its
+            parsed snapshot"""
+    
+    snapshots = True
+    snapshots_doc = """Set to False to always parse INI files in full"""
+    
+    @property
+    def mergedFiles(self):
+        """Returns the names of files merged by name, for reload()."""
+        return list(self._files)
+        
+        
+    def __init__(self, *args, **kwargs):
+        self._overlays = []
+        self._overlays_doc = """[ (handle, { section: dict }) ] for each merged
+                source, oldest first"""
+        self._nextHandle = 1
+        self._subscribers = []
+        self._subscribers_doc = """[ (callback, section or None) ]"""
+        self._writer = None
+        self._files = {}
+        self._files_doc = """{ filename: handle } for files merged by name"""
+        _reprConfig.__init__(self, *args, **kwargs)
+        
+        
     def merge(self, *args, **kwargs):
+        """Merge a dict, file, or filename over the current values.  Returns
+        a handle for unmerge(), or None if the file did not exist and
+        noExistOk was specified."""
         noExistOk = kwargs.pop('noExistOk', False)
         try:
-            other = _reprConfig(*args, **kwargs)
+            if (len(args) == 1 and not kwargs
+                    and isinstance(args[0], six.string_types)):
+                other = _reprConfig(loadIni(args[0], self.snapshots))
+            else:
+                other = _reprConfig(*args, **kwargs)
         except IOError:
             if noExistOk:
                 return
             raise
+        
+        overlay = {}
         for k, v in six.iteritems(other):
-            mergeFrom = self.get(k, {})
-            mergeFrom.update(v)
-            self[k] = mergeFrom
+            # Our own copy, so that later changes to the source don't leak in
+            v = dict(v)
+            overlay[k] = v
+            section = self._section(k)
+            changes = self._changesBefore(section, v)
+            section.maps.insert(1, v)
+            self._sectionClearLocal(section, v)
+            section._sectionTouched()
+            self._notify(section, changes, v)
+        
+        handle = self._nextHandle
+        self._nextHandle += 1
+        self._overlays.append((handle, overlay))
+        if len(args) == 1 and isinstance(args[0], six.string_types):
+            self._files[args[0]] = handle
+        return handle
+        
+        
+    def reload(self, fname, data = None):
+        """Replace the values merged from file fname, keeping its place among
+        the other sources, and notify subscribers of what changed.  data is
+        the file's parsed contents, as from loadIni(); if None, the file is
+        loaded now."""
+        handle = self._files.get(fname)
+        if handle is None:
+            raise KeyError("{0} was not merged by name".format(fname))
+        if data is None:
+            data = loadIni(fname, self.snapshots)
+        self._replaceSource(handle, _reprConfig(data))
+            
+            
+    def set(self, section, key, value):
+        """Set key in section, above all merged sources."""
+        s = self._section(section)
+        changes = self._changesBefore(s, { key: value })
+        s.maps[0][key] = value
+        s._sectionTouched()
+        self._notify(s, changes, { key: value })
+        
+        
+    def subscribe(self, callback, section = None):
+        """Call callback(config, section, changes) whenever values change,
+        where changes is { key: new value }, with DELETED as the value of
+        removed keys.  If section is given, only changes to that section are
+        reported."""
+        self._subscribers.append((callback, section))
+        
+        
+    def unmerge(self, handle):
+        """Take back out a source added by merge(), which returned handle."""
+        self._replaceSource(handle, {})
+        self._overlays = [ o for o in self._overlays if o[0] != handle ]
+        for fname, h in list(six.iteritems(self._files)):
+            if h == handle:
+                del self._files[fname]
             
             
-    def save(self, fname):
+    def unset(self, section, key):
+        """Remove key from section.  If a merged source has key, it stays
+        hidden until a later merge() or reload() supplies it again."""
+        s = self._section(section)
+        if key not in s:
+            raise KeyError(key)
+        changes = self._changesBefore(s, { key: None })
+        if any(key in m for m in s.maps[1:]):
+            s.maps[0][key] = DELETED
+        else:
+            del s.maps[0][key]
+        s._sectionTouched()
+        self._notify(s, changes, { key: None })
+        
+        
+    def unsubscribe(self, callback, section = None):
+        self._subscribers.remove((callback, section))
+        
+        
+    def _changesBefore(self, section, keys):
+        """Returns the current values of keys in section, or None if there
+        is no one to notify of changes to them."""
+        if not self._subscribers:
+            return None
+        flat = section.flat()
+        return dict([ (k, flat.get(k, DELETED)) for k in keys ])
+        
+        
+    def _notify(self, section, before, keys):
+        """Tell subscribers which of keys in section changed since before,
+        from _changesBefore()."""
+        if before is None:
+            return
+        flat = section.flat()
+        changes = {}
+        for k in keys:
+            value = flat.get(k, DELETED)
+            if value is not before[k] and value != before[k]:
+                changes[k] = value
+        if not changes:
+            return
+        for callback, name in list(self._subscribers):
+            if name is None or name == section.name:
+                callback(self, section.name, changes)
+                
+                
+    def _replaceSource(self, handle, other):
+        """Replace the source merged as handle with other, a
+        { section: dict }, in the same place in every section's overlays."""
+        for i, (h, overlay) in enumerate(self._overlays):
+            if h == handle:
+                break
+        else:
+            raise KeyError("No merged source with handle {0!r}".format(handle))
+        
+        newOverlay = {}
+        for name in set(overlay) | set(other):
+            old = overlay.get(name)
+            new = None
+            if name in other:
+                new = newOverlay[name] = dict(other[name])
+            section = self._section(name)
+            keys = set(old or ()) | set(new or ())
+            changes = self._changesBefore(section, keys)
+            maps = section.maps
+            if new is not None:
+                # Local values of keys that the source changed are stale
+                self._sectionClearLocal(section, [ k for k in new
+                        if old is None or k not in old
+                            or old[k] != new[k] ])
+            if old is None:
+                # Below the local overlay and any newer sources
+                newer = [ o for h2, o in self._overlays[i + 1:] if name in o ]
+                maps.insert(1 + len(newer), new)
+            else:
+                for j, m in enumerate(maps):
+                    if m is old:
+                        break
+                if new is None:
+                    del maps[j]
+                else:
+                    maps[j] = new
+            if len(maps) == 1:
+                # Nothing left to hide
+                self._sectionClearLocal(section, [ k for k, v
+                        in six.iteritems(maps[0]) if v is DELETED ])
+            section._sectionTouched()
+            self._notify(section, changes, keys)
+            if len(maps) == 1 and not maps[0]:
+                # Nothing left in it
+                del self[name]
+        self._overlays[i] = (handle, newOverlay)
+        
+        
+    def _section(self, name):
+        """Returns the Section named name, creating it if needed."""
+        section = self.get(name)
+        if isinstance(section, Section):
+            return section
+        maps = [ {} ]
+        if section is not None:
+            # Assigned directly as a plain dict; treat it as the oldest source
+            maps.append(section)
+        section = Section(self, name, maps)
+        self[name] = section
+        return section
+        
+        
+    def _sectionClearLocal(self, section, keys):
+        """Drop keys from section's local overlay; the caller touches the
+        section."""
+        local = section.maps[0]
+        for k in keys:
+            local.pop(k, None)
+        
+        
+    def flush(self):
+        """Wait for any background saves to finish.  Raises the first error
+        that any of them hit."""
+        if self._writer is not None:
+            self._writer.flush()
+        
+        
+    def save(self, fname, background = False):
         """Save this config out to fname.
+        
+        Sections are serialized again only if changed (through set(),
+        merge(), reload() or unmerge()) since the last save.  Sections that
+        hold mutable values, such as a list of high scores that may be
+        appended to in place, are serialized on every save.
+        
+        If background, the file is written on a writer thread, and save()
+        returns as soon as the contents are serialized.  Saves to the same
+        file that queue up behind a slow write are coalesced into one.
         """
-        # We keep the output in a buffer before it's all generated; that way,
-        # if there's an error, we don't screw up the old file by only
-        # writing part of the output
         bufferOut = []
-        for s, v in six.iteritems(self):
-            bufferOut.append('[{0}]\n'.format(s))
-            for k, kv in six.iteritems(v):
-                bufferOut.append('{0} = {1}\n'.format(k, repr(kv)))
-            bufferOut.append('\n')
-        bufferOut = ''.join(bufferOut)
-        with open(fname, 'w') as f:
-            f.write(bufferOut)
+        for s, v in list(six.iteritems(self)):
+            if isinstance(v, dict):
+                # Assigned directly; wrap it so that its text can be kept
+                v = self._section(s)
+            text = getattr(v, '_text', None)
+            if text is None:
+                text = [ '[{0}]\n'.format(s) ]
+                keep = isinstance(v, Section)
+                for k, kv in six.iteritems(v):
+                    text.append('{0} = {1}\n'.format(k, repr(kv)))
+                    if keep and not _isImmutable(kv):
+                        # Could change without the section knowing
+                        keep = False
+                text.append('\n')
+                text = ''.join(text)
+                if keep:
+                    v._text = text
+            bufferOut.append(text)
+        data = ''.join(bufferOut).encode('utf-8')
+        
+        if background:
+            if self._writer is None:
+                self._writer = _Writer()
+            self._writer.write(fname, data)
+        else:
+            # Don't let an older background save land on top of this one
+            self.flush()
+            _writeAtomic(fname, data)
             
             
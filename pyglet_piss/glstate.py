@@ -0,0 +1,188 @@
+
+import pyglet.gl as gl
+
+class GlState(object):
+    """Shadow copy of the OpenGL state that pyglet_piss changes while drawing
+    (capabilities, scissor box, viewport, depth settings, matrix mode and the
+    projection matrix).  Requests for state that is already current are
+    elided rather than sent to OpenGL.
+
+    Only changes made through this object are known to it.  Code that changes
+    the same state directly while drawing must restore it, or call
+    invalidate() (or projectionChanged() for the projection matrix).
+
+    Each window has its own GL context, so the shadow copy is only good for
+    the context it was built in; Application calls switchContext() before
+    drawing each window, and nextFrame() after.
+
+    The module-level instance, state, is used by Scene, Layer and Layer3d.
+    """
+
+    def __init__(self):
+        self.issued = 0
+        self.issued_doc = """GL calls issued since the last nextFrame()"""
+        self.elided = 0
+        self.elided_doc = """GL calls elided since the last nextFrame()"""
+        self.lastFrameIssued = 0
+        self.lastFrameIssued_doc = """GL calls issued while drawing the last
+                window drawn"""
+        self.lastFrameElided = 0
+        self.lastFrameElided_doc = """GL calls elided while drawing the last
+                window drawn"""
+        self._context = None
+        self._context_doc = """The GL context that the shadow copy is for"""
+        self.reset()
+
+
+    def clearDepth(self, depth):
+        if depth == self._clearDepth:
+            self.elided += 1
+            return
+        gl.glClearDepth(depth)
+        self._clearDepth = depth
+        self.issued += 1
+
+
+    def depthFunc(self, func):
+        if func == self._depthFunc:
+            self.elided += 1
+            return
+        gl.glDepthFunc(func)
+        self._depthFunc = func
+        self.issued += 1
+
+
+    def disable(self, cap):
+        if self._enabled.get(cap) is False:
+            self.elided += 1
+            return
+        gl.glDisable(cap)
+        self._enabled[cap] = False
+        self.issued += 1
+
+
+    def enable(self, cap):
+        if self._enabled.get(cap) is True:
+            self.elided += 1
+            return
+        gl.glEnable(cap)
+        self._enabled[cap] = True
+        self.issued += 1
+
+
+    def invalidate(self):
+        """Forget all tracked state, so that the next request for any of it
+        is issued."""
+        self._enabled = {}
+        self._scissor = False
+        self._viewport = None
+        self._clearDepth = None
+        self._depthFunc = None
+        self._matrixMode = None
+        self._projection = False
+
+
+    def matrixMode(self, mode):
+        if mode == self._matrixMode:
+            self.elided += 1
+            return
+        gl.glMatrixMode(mode)
+        self._matrixMode = mode
+        self.issued += 1
+
+
+    def nextFrame(self):
+        """Publish the call counts of the window just drawn as
+        lastFrameIssued and lastFrameElided, and start counting again."""
+        self.lastFrameIssued = self.issued
+        self.lastFrameElided = self.elided
+        self.issued = 0
+        self.elided = 0
+
+
+    def projectionChanged(self):
+        """Note that the projection matrix was changed directly."""
+        self._projection = False
+
+
+    def reset(self):
+        """Assume the state that pyglet_piss leaves between scenes: no
+        scissoring, the window's own projection matrix (not pushed), and
+        GL_MODELVIEW as the matrix mode.  Everything else is unknown."""
+        self.invalidate()
+        self._enabled[gl.GL_SCISSOR_TEST] = False
+        self._scissor = None
+        self._matrixMode = gl.GL_MODELVIEW
+        self._projection = None
+        self._projectionPushed = False
+
+
+    def restoreProjection(self):
+        """Return to the window's own projection matrix, popping anything
+        loaded with setProjection()."""
+        if self._projection is None:
+            self.elided += 1
+            return
+        if self._projectionPushed:
+            self.matrixMode(gl.GL_PROJECTION)
+            gl.glPopMatrix()
+            self.issued += 1
+            self.matrixMode(gl.GL_MODELVIEW)
+            self._projectionPushed = False
+        self._projection = None
+
+
+    def scissor(self, box):
+        """Scissor to box, (x, y, width, height), or disable scissoring if
+        box is None."""
+        if box == self._scissor:
+            self.elided += 1
+            return
+        if box is None:
+            self.disable(gl.GL_SCISSOR_TEST)
+        else:
+            self.enable(gl.GL_SCISSOR_TEST)
+            gl.glScissor(*box)
+            self.issued += 1
+        self._scissor = box
+
+
+    def setProjection(self, matrix, glMatrix):
+        """Load a projection matrix, saving the window's own projection the
+        first time.  matrix is a 16-tuple used to compare against the current
+        projection, and glMatrix is the same values as a GLfloat array."""
+        if matrix == self._projection:
+            self.elided += 1
+            return
+        self.matrixMode(gl.GL_PROJECTION)
+        if not self._projectionPushed:
+            gl.glPushMatrix()
+            self.issued += 1
+            self._projectionPushed = True
+        gl.glLoadMatrixf(glMatrix)
+        self.issued += 1
+        self.matrixMode(gl.GL_MODELVIEW)
+        self._projection = matrix
+
+
+    def switchContext(self, context):
+        """Note that context (a pyglet.gl.Context) is now current.  If it is
+        not the context that the shadow copy was built in, start again from
+        reset()."""
+        if context is self._context:
+            return
+        self._context = context
+        self.reset()
+
+
+    def viewport(self, box):
+        if box == self._viewport:
+            self.elided += 1
+            return
+        gl.glViewport(*box)
+        self._viewport = box
+        self.issued += 1
+
+
+
+state = GlState()
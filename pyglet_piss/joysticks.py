@@ -0,0 +1,225 @@
+
+from pyglet_piss.actionqueue import now
+from pyglet_piss.player import JoystickPlayer, KeyboardPlayer
+
+import logging
+import os
+import pyglet
+
+_log = logging.getLogger(__name__)
+
+_evdevNodes = {}
+_evdevNodes_doc = """{ device path: (inode, ctime) } of evdev device files as
+        first seen, to tell a device file that was removed and created
+        again (the inode alone may be reused)"""
+
+def _evdevNode(path):
+    """Returns (inode, ctime) of device file path, or None if it is gone."""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return (st.st_ino, st.st_ctime)
+
+
+def _deviceKeys(joysticks):
+    """Returns a stable key for each of joysticks.  Evdev devices (Linux)
+    are keyed by their device file and its identity, so that a new pad given a
+    disconnected pad's /dev/input/eventN is told apart.  Other backends do
+    not expose a device file; their devices are keyed by name and
+    occurrence."""
+    keys = []
+    seen = {}
+    for j in joysticks:
+        path = getattr(j.device, '_filename', None)
+        if path is not None:
+            node = _evdevNodes.get(path)
+            if node is None:
+                node = _evdevNodes[path] = _evdevNode(path)
+            key = (path, node)
+        else:
+            name = j.device.name
+            seen[name] = seen.get(name, 0) + 1
+            key = (name, seen[name])
+        keys.append(key)
+    return keys
+
+
+def _pruneEvdev():
+    """pyglet's evdev backend caches every device it opens, by path, and
+    never forgets one, so an unplugged pad would be reported forever and a
+    new pad on the same path never noticed.  Evict cached devices whose
+    file is gone or has been replaced."""
+    try:
+        from pyglet.input import evdev
+    except ImportError:
+        return
+    cache = getattr(evdev, '_devices', None)
+    if cache is None:
+        return
+    for path in list(cache):
+        node = _evdevNode(path)
+        known = _evdevNodes.get(path)
+        if node is None or (known is not None and node != known):
+            del cache[path]
+            _evdevNodes.pop(path, None)
+        else:
+            _evdevNodes[path] = node
+
+
+
+class JoystickManager(object):
+    """Keeps one JoystickPlayer per connected joystick as devices come and
+    go, and enables keyboard players whose config section allows being
+    replaced by a joystick (replaceWithJoystick, the default) only while
+    there are too few joysticks.
+
+    Devices are rescanned from pyglet's clock, on the main thread, since
+    pyglet's device enumeration is not thread-safe (and on Windows needs COM
+    initialized on the calling thread).  Each rescan is split over two
+    ticks, so that no one frame pays for all of it: the first drops devices
+    whose files are gone (see _pruneEvdev()), and the next enumerates.  A
+    rescan that finds the same devices as the last one changes nothing.
+
+    Rescans start every interval seconds.  While a step takes longer than
+    budget seconds, the interval doubles, up to maxInterval; once steps are
+    back under budget, it halves again, down to the interval given to
+    start().  Failed rescans are logged, and rescanning continues.
+    """
+
+    def __init__(self, app, possibleKeyboards):
+        self.app = app
+        self.interval = None
+        self.interval_doc = """Current seconds between rescans, or None if not
+                rescanning"""
+        self.minInterval = None
+        self.minInterval_doc = """The interval given to start(), which
+                interval returns to once rescans are quick again"""
+        self.maxInterval = 60.0
+        self.maxInterval_doc = """Longest that interval grows to while rescans
+                are slow"""
+        self.budget = 0.002
+        self.budget_doc = """Seconds a step of a rescan may take before
+                rescans are made less frequent"""
+        self.rescans = 0
+        self.rescans_doc = """Number of completed device scans"""
+        self._possibleKeyboards = list(possibleKeyboards)
+        self._possibleKeyboards_doc = """Config mappings for keyboard players
+                to use while joysticks are missing, in order of preference"""
+        self._keyboards = []
+        self._keyboards_doc = """KeyboardPlayers created from
+                _possibleKeyboards, in the same order"""
+        self._players = {}
+        self._players_doc = """{ device key: JoystickPlayer }"""
+        self._scannedKeys = set()
+        self._scannedKeys_doc = """Device keys found by the last rescan"""
+
+
+    def rescan(self):
+        """Scan for devices now, and add and remove players to match.  Call
+        only from the main thread, outside of Application.update()."""
+        keys, joysticks = self.scan()
+        self._rescanFound(keys, joysticks)
+
+
+    def scan(self):
+        """Returns (device keys, joysticks) for the connected joysticks.
+        Call only from the main thread."""
+        _pruneEvdev()
+        joysticks = pyglet.input.get_joysticks()
+        return _deviceKeys(joysticks), joysticks
+
+
+    def start(self, interval):
+        """Rescan devices every interval seconds (or less often, while
+        rescans are slow)."""
+        self.stop()
+        self.interval = self.minInterval = interval
+        self._scannedKeys = set(self._players)
+        pyglet.clock.schedule_once(self._scheduledPrune, interval)
+
+
+    def stop(self):
+        """Stop rescanning."""
+        if self.interval is not None:
+            pyglet.clock.unschedule(self._scheduledPrune)
+            pyglet.clock.unschedule(self._scheduledEnumerate)
+        self.interval = None
+
+
+    def sync(self, keys, joysticks):
+        """Make the application's players match joysticks (with device keys
+        keys, from _deviceKeys()).  Call only from the main thread."""
+        app = self.app
+        known = self._players
+        current = set(keys)
+        for key in list(known):
+            if key not in current:
+                player = known.pop(key)
+                try:
+                    player._joystick.close()
+                except Exception:
+                    # The device is already gone
+                    pass
+                app.removePlayer(player)
+
+        # Keyboards fill in for missing joysticks, in config order.  Adjust
+        # them first so that new joysticks come after them, as at startup.
+        wanted = max(0, len(self._possibleKeyboards) - len(keys))
+        while len(self._keyboards) > wanted:
+            app.removePlayer(self._keyboards.pop())
+        while len(self._keyboards) < wanted:
+            player = KeyboardPlayer(
+                    self._possibleKeyboards[len(self._keyboards)])
+            self._keyboards.append(player)
+            app.addPlayer(player)
+
+        for key, j in zip(keys, joysticks):
+            if key not in known:
+                player = known[key] = JoystickPlayer(j)
+                app.addPlayer(player)
+
+
+    def _rescanFound(self, keys, joysticks):
+        """Finish a rescan that found joysticks, with device keys keys."""
+        self.rescans += 1
+        if set(keys) == self._scannedKeys:
+            # Nothing changed
+            return
+        self._scannedKeys = set(keys)
+        self.sync(keys, joysticks)
+
+
+    def _scheduledEnumerate(self, dt):
+        """Second step of a scheduled rescan: enumerate and sync, then
+        schedule the next rescan."""
+        pyglet.clock.unschedule(self._scheduledEnumerate)
+        start = now()
+        try:
+            joysticks = pyglet.input.get_joysticks()
+            self._rescanFound(_deviceKeys(joysticks), joysticks)
+        except Exception:
+            _log.exception("Joystick rescan failed")
+        self._scheduledAdjust(now() - start)
+        pyglet.clock.schedule_once(self._scheduledPrune, self.interval)
+
+
+    def _scheduledAdjust(self, seconds):
+        """Adjust interval for a rescan step that took seconds."""
+        if seconds > self.budget:
+            self.interval = min(self.interval * 2, self.maxInterval)
+        else:
+            self.interval = max(self.interval * 0.5, self.minInterval)
+
+
+    def _scheduledPrune(self, dt):
+        """First step of a scheduled rescan: drop vanished devices, which
+        only stats their files, and enumerate on the next tick."""
+        start = now()
+        try:
+            _pruneEvdev()
+        except Exception:
+            _log.exception("Joystick rescan failed")
+        self._scheduledAdjust(now() - start)
+        # Runs from the next tick, not this one
+        pyglet.clock.schedule(self._scheduledEnumerate)
@@ -1,7 +1,24 @@
 
-from .common import frameCachedProperty
+from .common import _frameGeneration, ortho2d
+from .glstate import state as glState
 
+import pyglet
 import pyglet.gl as gl
+import six
+
+def handlesAction(*actions):
+    """Decorator for Layer methods, marking the method as the handler for
+    each of the given Actions codes.  The method is called as
+    method(player, action), and should return True if the action was handled.
+    See Layer.actionHandlers.
+    """
+    def decorate(f):
+        f._layerHandlesActions = getattr(f, '_layerHandlesActions', ()) \
+                + actions
+        return f
+    return decorate
+
+
 
 class Layer(object):
     """A renderable, updateable, input-handling segment of the display.
@@ -63,11 +80,33 @@ class Layer(object):
             the range of displayed pixels.
             """
 
+    actionHandlers = {}
+    actionHandlers_doc = """Class-level map of { Actions code: method name }.
+            Together with methods decorated with @handlesAction, this declares
+            which actions this layer wants; the scene only offers an action to
+            layers that declared it, or that override onAction() to see every
+            action.  A layer's declared handler is called before its
+            onAction().  Handlers are compiled per class, so changing this map
+            after a layer of the class is added has no effect."""
+
+    _layerCount = 0
+    _layerCount_doc = """Number of layers ever initialized; used to name
+            layers in profiles"""
+
     suspendsLower = False
     suspendsLower_doc = """True if any lower layers' update functions
             should not be called (drawing still occurs)."""
 
 
+    @property
+    def batch(self):
+        """Returns this layer's pyglet.graphics.Batch, creating it on first
+        use.  The batch is drawn once per frame, after onDraw(), with this
+        layer's projection and scissor box in effect; see also batchGroup(),
+        addLabel() and addSprite()."""
+        return self._layerEnsureBatch()
+
+
     @property
     def bottom(self):
         """Returns the local-space bottom boundary of this layer."""
@@ -82,11 +121,16 @@ class Layer(object):
 
 
     @property
-    @frameCachedProperty
     def boundsScreen(self):
         """Returns (left, bottom, right, top) for screen-space."""
-        cl = self.coordsScreen
-        return (cl[0], cl[1], cl[0] + cl[2], cl[1] + cl[3])
+        if self._geometryGeneration != _frameGeneration[0]:
+            self._layerCheckGeometry()
+        result = self._boundsScreen
+        if result is None:
+            cl = self.coordsScreen
+            result = self._boundsScreen = (cl[0], cl[1], cl[0] + cl[2],
+                    cl[1] + cl[3])
+        return result
 
 
     @property
@@ -97,79 +141,31 @@ class Layer(object):
 
 
     @property
-    @frameCachedProperty
     def coordsLocal(self):
         """Returns (left, bottom, w, h) for local-space."""
-        # Calculate our centers and half-dimensions, and the screen aspect
-        # ratio that has been assigned to us
-        lx = 0
-        ly = 0
-        lw = 0
-        lh = 0
-        if self._scissorBox is None:
-            if self.localBounds is None:
-                return (0, 0, self.scene.width, self.scene.height)
-            sa = max(1., self.scene.width) / max(1., self.scene.height)
-        else:
-            sa = max(1., self._scissorBox[2]) / max(1., self._scissorBox[3])
-
-        if self.localBounds is None:
-            lx = self.scene.width * 0.5
-            ly = self.scene.height * 0.5
-            lw = lx
-            lh = ly
-        else:
-            lw = (self.localBounds[2] - self.localBounds[0]) * 0.5
-            lh = (self.localBounds[3] - self.localBounds[1]) * 0.5
-            lx = self.localBounds[0] + lw
-            ly = self.localBounds[1] + lh
-
-        # Now, we have our coordinates and the screen aspect ratio.  Do some
-        # processing
-        if self.scissorMode == Layer.SCISSOR_CLIP:
-            if self.localBounds is not None:
-                raise ValueError("Layer.SCISSOR_CLIP cannot be used with "
-                        "Layer.localBounds")
-
-            # Special case, return our scissor box clipped to
-            return (0, 0, self._scissorBox[2], self._scissorBox[3])
-        elif self.scissorMode == Layer.SCISSOR_STRETCH:
-            # Another special case, just leave our local zone as-is
-            pass
-        elif self.scissorMode == Layer.SCISSOR_SCALE_BIG:
-            la = lw / lh
-            if la > sa:
-                lw = lh * sa
-            else:
-                lh = lw / sa
-        elif self.scissorMode == Layer.SCISSOR_SCALE_SMALL:
-            la = lw / lh
-            if la > sa:
-                lh = lw / sa
-            else:
-                lw = lh * sa
-        elif self.scissorMode == Layer.SCISSOR_SCALE_HEIGHT:
-            lw = lh * sa
-        elif self.scissorMode == Layer.SCISSOR_SCALE_WIDTH:
-            lh = lw * sa
-        else:
-            raise NotImplementedError()
-
-        if self.localBounds is None:
-            lx = lw
-            ly = lh
-        return (lx - lw, ly - lh, lw * 2.0, lh * 2.0)
+        if self._geometryGeneration != _frameGeneration[0]:
+            self._layerCheckGeometry()
+        result = self._coordsLocal
+        if result is None:
+            result = self._coordsLocal = self._layerComputeCoordsLocal()
+        return result
 
 
     @property
     def coordsScreen(self):
         """Returns (left, bottom, w, h) for screen-space."""
-        if self._scissorBox is None:
-            return (0, 0, max(1, self.scene.width), max(1, self.scene.height))
-        sbCopy = list(self._scissorBox)
-        sbCopy[2] = max(1, sbCopy[2])
-        sbCopy[3] = max(1, sbCopy[3])
-        return sbCopy
+        if self._geometryGeneration != _frameGeneration[0]:
+            self._layerCheckGeometry()
+        result = self._coordsScreen
+        if result is None:
+            if self._scissorBox is None:
+                result = (0, 0, max(1, self.scene.width),
+                        max(1, self.scene.height))
+            else:
+                sb = self._scissorBox
+                result = (sb[0], sb[1], max(1, sb[2]), max(1, sb[3]))
+            self._coordsScreen = result
+        return result
 
 
     @property
@@ -227,6 +223,13 @@ class Layer(object):
         return cl[1] + cl[3]
 
 
+    @property
+    def updateAlpha(self):
+        """Returns the scene's interpolation alpha for drawing between fixed
+        update steps; see Scene.updateAlpha."""
+        return self.scene.updateAlpha
+
+
     @property
     def width(self):
         """Returns the render-space width of this layer."""
@@ -242,6 +245,41 @@ class Layer(object):
         self.__isInit = False
         self.scene = None
         self._scissorBox = None
+        self._batch = None
+        self._layerInvalidateGeometry()
+
+
+    def __setattr__(self, name, value):
+        object.__setattr__(self, name, value)
+        if name == 'localBounds' or name == 'scissorMode':
+            self._layerInvalidateGeometry()
+
+
+    def addLabel(self, text = '', order = 0, **kwargs):
+        """Returns a pyglet.text.Label drawn as part of this layer's batch,
+        in batchGroup(order).  Keep the label and change its properties
+        rather than creating a new one each frame."""
+        return pyglet.text.Label(text, batch = self.batch,
+                group = self.batchGroup(order), **kwargs)
+
+
+    def addSprite(self, image, order = 0, **kwargs):
+        """Returns a pyglet.sprite.Sprite drawn as part of this layer's batch,
+        in batchGroup(order)."""
+        return pyglet.sprite.Sprite(image, batch = self.batch,
+                group = self.batchGroup(order), **kwargs)
+
+
+    def batchGroup(self, order = 0):
+        """Returns the pyglet.graphics.OrderedGroup for order within this
+        layer's batch; groups with a higher order draw on top.  Each group
+        establishes this layer's projection and scissor box."""
+        self._layerEnsureBatch()
+        group = self._batchGroups.get(order)
+        if group is None:
+            group = self._batchGroups[order] = pyglet.graphics.OrderedGroup(
+                    order, parent = self._batchStateGroup)
+        return group
 
 
     def onAction(self, player, action):
@@ -252,34 +290,31 @@ class Layer(object):
 
 
     def onDraw(self):
-        """Called when this layer should draw."""
+        """Called when this layer should draw.  With a fixed timestep, use
+        self.updateAlpha to interpolate between the last two updates."""
 
 
     def onUpdate(self, dt):
         """Called when this layer should update its members; dt is the number
         of seconds since the last update (multiply any action with quantity
-        by this to regulate game speed)."""
+        by this to regulate game speed).  With a fixed timestep, dt is always
+        the step length and this may be called zero or several times per
+        rendered frame."""
 
 
     def preDraw(self):
         """Called right before this layer draws; establishes e.g. scissor box
-        and scaling."""
-        if self._scissorBox is not None:
-            gl.glEnable(gl.GL_SCISSOR_TEST)
-            gl.glScissor(*self._scissorBox)
-
+        and scaling.  State that is already current (e.g. because the layer
+        below shares this layer's scissor box and projection) is not set
+        again."""
+        glState.scissor(self._scissorBox)
         self._layerProjectLocalToScreen()
 
 
     def postDraw(self):
-        """Called right after this layer draws; should revert any changes from
-        preDraw()."""
-        self._layerProjectLocalToScreenUndo()
-
-        if self._scissorBox is not None:
-            gl.glDisable(gl.GL_SCISSOR_TEST)
-
-        frameCachedProperty.clear(self)
+        """Called right after this layer draws.  The scissor box and
+        projection from preDraw() are left in place for the next layer; the
+        scene restores them after its last layer is drawn."""
 
 
     def pushLayer(self, layer):
@@ -313,6 +348,7 @@ class Layer(object):
             width = int(width) if width is not None else self.scene.width - x
             height = int(height) if height is not None else self.scene.height - y
             self._scissorBox = (x, y, width, height)
+        self._layerInvalidateGeometry()
 
 
     def quitScene(self):
@@ -339,25 +375,100 @@ class Layer(object):
         return _RestoreProjectionAndModelview()
 
 
-    def _layerInit(self, scene):
-        """Called when added to application (added to scene) for first
-        time.
-        """
-        if self.__isInit:
-            # Already initialized and added, all is well
-            raise RuntimeError("Cannot add layer twice")
+    def _layerCheckGeometry(self):
+        """Forget our cached geometry if anything it was computed from
+        (localBounds, scissorMode, the scissor box, or the scene size) has
+        changed since.  These are compared rather than tracked through
+        setters, so that subclasses may set any of them as class
+        attributes, and so that a localBounds list changed in place is
+        noticed.
+
+        The accessors only call this once per frame generation (see
+        common.frameCachedProperty); assigning localBounds or scissorMode
+        invalidates at once, through __setattr__()."""
+        bounds = self.localBounds
+        if bounds is not None:
+            # A list could be changed in place
+            bounds = tuple(bounds)
+        scene = self.scene
+        key = (bounds, self.scissorMode, self._scissorBox, scene._width,
+                scene._height)
+        if key != self._geometryKey:
+            self._layerInvalidateGeometry()
+            self._geometryKey = key
+        self._geometryGeneration = _frameGeneration[0]
+
+
+    def _layerComputeCoordsLocal(self):
+        """Computes coordsLocal from our bounds, scissor box and mode."""
+        # Calculate our centers and half-dimensions, and the screen aspect
+        # ratio that has been assigned to us
+        lx = 0
+        ly = 0
+        lw = 0
+        lh = 0
+        if self._scissorBox is None:
+            if self.localBounds is None:
+                return (0, 0, self.scene.width, self.scene.height)
+            sa = max(1., self.scene.width) / max(1., self.scene.height)
+        else:
+            sa = max(1., self._scissorBox[2]) / max(1., self._scissorBox[3])
 
-        self.__isInit = True
-        self.scene = scene
+        if self.localBounds is None:
+            lx = self.scene.width * 0.5
+            ly = self.scene.height * 0.5
+            lw = lx
+            lh = ly
+        else:
+            lw = (self.localBounds[2] - self.localBounds[0]) * 0.5
+            lh = (self.localBounds[3] - self.localBounds[1]) * 0.5
+            lx = self.localBounds[0] + lw
+            ly = self.localBounds[1] + lh
 
+        # Now, we have our coordinates and the screen aspect ratio.  Do some
+        # processing
+        if self.scissorMode == Layer.SCISSOR_CLIP:
+            if self.localBounds is not None:
+                raise ValueError("Layer.SCISSOR_CLIP cannot be used with "
+                        "Layer.localBounds")
 
-    def _layerProjectLocalToScreen(self):
-        """Maps self.coordLocal to self.coordScreen within OpenGL."""
+            # Special case, return our scissor box clipped to
+            return (0, 0, self._scissorBox[2], self._scissorBox[3])
+        elif self.scissorMode == Layer.SCISSOR_STRETCH:
+            # Another special case, just leave our local zone as-is
+            pass
+        elif self.scissorMode == Layer.SCISSOR_SCALE_BIG:
+            la = lw / lh
+            if la > sa:
+                lw = lh * sa
+            else:
+                lh = lw / sa
+        elif self.scissorMode == Layer.SCISSOR_SCALE_SMALL:
+            la = lw / lh
+            if la > sa:
+                lh = lw / sa
+            else:
+                lw = lh * sa
+        elif self.scissorMode == Layer.SCISSOR_SCALE_HEIGHT:
+            lw = lh * sa
+        elif self.scissorMode == Layer.SCISSOR_SCALE_WIDTH:
+            lh = lw * sa
+        else:
+            raise NotImplementedError()
+
+        if self.localBounds is None:
+            lx = lw
+            ly = lh
+        return (lx - lw, ly - lh, lw * 2.0, lh * 2.0)
+
+
+    def _layerComputeProjection(self):
+        """Returns None if we draw in the window's pixel coordinates, or
+        (matrix, glMatrix) mapping coordsLocal to coordsScreen, where matrix
+        is a 16-tuple and glMatrix is the same values as a GLfloat array."""
         if self._scissorBox is None and self.localBounds is None:
-            return
-        gl.glMatrixMode(gl.GL_PROJECTION)
-        gl.glPushMatrix()
-        gl.glLoadIdentity()
+            return None
+
         # gluOrtho2D declares the render space for the corners of the window.
         # So, we want to set it up in such a way that our layer renders in
         # the right place.  In other words, determine window corners that
@@ -377,17 +488,105 @@ class Layer(object):
         # cs[0] / sw = (x - nx) / ww
         nx = cl[0] - cs[0] * ww / sw
         ny = cl[1] - cs[1] * wh / sh
-        gl.gluOrtho2D(nx, nx+ww, ny, ny+wh)
-        gl.glMatrixMode(gl.GL_MODELVIEW)
+        matrix = ortho2d(nx, nx+ww, ny, ny+wh)
+        return (matrix, (gl.GLfloat * 16)(*matrix))
 
 
-    def _layerProjectLocalToScreenUndo(self):
-        """Undoes the _layerProjectLocalToScreen() operation."""
-        if self._scissorBox is None and self.localBounds is None:
-            return
-        gl.glMatrixMode(gl.GL_PROJECTION)
-        gl.glPopMatrix()
-        gl.glMatrixMode(gl.GL_MODELVIEW)
+    def _layerEnsureBatch(self):
+        """Create our batch and its groups if not yet created; returns the
+        batch."""
+        if self._batch is None:
+            self._batch = pyglet.graphics.Batch()
+            self._batchGroups = {}
+            self._batchStateGroup = _LayerStateGroup(self)
+        return self._batch
+
+
+    def _layerInit(self, scene):
+        """Called when added to application (added to scene) for first
+        time.
+        """
+        if self.__isInit:
+            # Already initialized and added, all is well
+            raise RuntimeError("Cannot add layer twice")
+
+        self.__isInit = True
+        self.scene = scene
+
+        Layer._layerCount += 1
+        self._layerProfileName = '{0}#{1}'.format(type(self).__name__,
+                Layer._layerCount)
+        self._layerProfileKeys = tuple([ self._layerProfileName + '.' + phase
+                for phase in ('onUpdate', 'preDraw', 'onDraw', 'postDraw') ])
+
+
+    def _layerProjectLocalToScreen(self):
+        """Maps self.coordLocal to self.coordScreen within OpenGL, by loading
+        our cached projection matrix (unless it is already loaded)."""
+        if self._geometryGeneration != _frameGeneration[0]:
+            self._layerCheckGeometry()
+        projection = self._projection
+        if projection is False:
+            projection = self._projection = self._layerComputeProjection()
+
+        if projection is None:
+            # Pixel coordinates; the window's own projection
+            glState.restoreProjection()
+        else:
+            glState.setProjection(*projection)
+
+
+    def _layerProjectionChanged(self):
+        """Must be called by layers that change the projection matrix while
+        drawing without restoring it, so that the next layer reloads its
+        own."""
+        glState.projectionChanged()
+
+
+    @classmethod
+    def _layerActionMap(cls):
+        """Returns { action: [ method name ] } for the handlers declared on
+        cls, computed once per class."""
+        cached = cls.__dict__.get('_layerActionMapCache')
+        if cached is not None:
+            return cached
+
+        result = {}
+        for name in dir(cls):
+            f = getattr(cls, name, None)
+            for action in getattr(f, '_layerHandlesActions', ()):
+                result.setdefault(action, []).append(name)
+        for action, name in six.iteritems(cls.actionHandlers):
+            names = result.setdefault(action, [])
+            if name not in names:
+                names.append(name)
+        cls._layerActionMapCache = result
+        return result
+
+
+    def _layerActionHandlers(self):
+        """Returns ({ action: [ bound handler ] }, genericHandler) for this
+        layer.  genericHandler is our onAction() if it is overridden, or
+        None."""
+        specific = {}
+        for action, names in six.iteritems(self._layerActionMap()):
+            specific[action] = [ getattr(self, n) for n in names ]
+
+        generic = None
+        if (six.get_unbound_function(type(self).onAction)
+                is not six.get_unbound_function(Layer.onAction)):
+            generic = self.onAction
+        return specific, generic
+
+
+    def _layerInvalidateGeometry(self):
+        """Forget our cached geometry; see _layerCheckGeometry()."""
+        self._geometryKey = None
+        self._geometryGeneration = None
+        self._coordsLocal = None
+        self._coordsScreen = None
+        self._boundsScreen = None
+        self._projection = False
 
 
     def _layerMapToScreen(self, localX, localY):
@@ -401,6 +600,21 @@ class Layer(object):
 
 
 
+class _LayerStateGroup(pyglet.graphics.Group):
+    """Parent of a layer's batch groups; establishes the layer's scissor box
+    and projection (a no-op when they are already current)."""
+
+    def __init__(self, layer):
+        pyglet.graphics.Group.__init__(self)
+        self.layer = layer
+
+
+    def set_state(self):
+        glState.scissor(self.layer._scissorBox)
+        self.layer._layerProjectLocalToScreen()
+
+
+
 class _RestoreProjectionAndModelview(object):
     def __enter__(self):
         return self
@@ -1,60 +1,240 @@
 
+import pyglet
 from pyglet.gl import *
 from pyglet_piss import Layer
+from pyglet_piss.common import perspective
+from pyglet_piss.glstate import state as glState
+
+class MeshTransform(pyglet.graphics.Group):
+    """A transform shared by any number of meshes in a Layer3d.  Meshes are
+    drawn translated to (x, y, z), rotated by angle degrees around axis, and
+    then uniformly scaled by scale.  The batch draws all meshes sharing a
+    transform together, with one state change; pass it to
+    Layer3d.addMesh(transform = ...).
+    """
+
+    def __init__(self):
+        pyglet.graphics.Group.__init__(self)
+        self.x = 0.0
+        self.y = 0.0
+        self.z = 0.0
+        self.angle = 0.0
+        self.axis = (0.0, 0.0, 1.0)
+        self.scale = 1.0
+
+
+    def set_state(self):
+        glPushMatrix()
+        glTranslatef(self.x, self.y, self.z)
+        if self.angle:
+            glRotatef(self.angle, *self.axis)
+        if self.scale != 1.0:
+            glScalef(self.scale, self.scale, self.scale)
+
+
+    def unset_state(self):
+        glPopMatrix()
+
+
+
+def _meshTransformAttribute(name):
+    def getter(self):
+        return getattr(self.transform, name)
+    def setter(self, value):
+        setattr(self._meshOwnTransform(), name, value)
+    return property(getter, setter, doc = """The {0} of this mesh's
+            transform""".format(name))
+
+
+
+class Mesh(object):
+    """Retained geometry for a Layer3d; see Layer3d.addMesh().  The vertex
+    data is uploaded once, the first time the layer draws.  Afterwards, only
+    the mesh's transform should change from frame to frame.
+
+    Meshes added without a transform share the layer's untransformed
+    group, so that they are drawn together.  Setting x, y, z, angle, axis
+    or scale on such a mesh first moves it to a MeshTransform of its own.
+    Setting them on a mesh added with a transform changes that transform,
+    and so every mesh sharing it.
+    """
+
+    x = _meshTransformAttribute('x')
+    y = _meshTransformAttribute('y')
+    z = _meshTransformAttribute('z')
+    angle = _meshTransformAttribute('angle')
+    axis = _meshTransformAttribute('axis')
+    scale = _meshTransformAttribute('scale')
+
+    def __init__(self, mode, vertices, colors = None, normals = None,
+            transform = None, shared = False):
+        self.transform = transform
+        self.transform_doc = """The MeshTransform this mesh is drawn with"""
+        self.vertexList = None
+        self.vertexList_doc = """The pyglet vertex list holding our geometry,
+                or None until uploaded"""
+        self._shared = shared
+        self._shared_doc = """True while transform is the layer's shared
+                untransformed group, which must not be changed"""
+        self._batch = None
+
+        count = len(vertices) // 3
+        self._mode = mode
+        self._count = count
+        self._attributes = [ ('v3f/static', vertices) ]
+        if colors is not None:
+            size = len(colors) // count
+            self._attributes.append(('c{0}B/static'.format(size), colors))
+        if normals is not None:
+            self._attributes.append(('n3f/static', normals))
+
+
+    def delete(self):
+        """Free this mesh's vertex list."""
+        if self.vertexList is not None:
+            self.vertexList.delete()
+            self.vertexList = None
+        self._attributes = None
+
+
+    def _meshOwnTransform(self):
+        """Returns our transform, after moving to one of our own if we were
+        sharing the layer's untransformed group."""
+        if self._shared:
+            self.transform = MeshTransform()
+            self._shared = False
+            if self.vertexList is not None:
+                self._batch.migrate(self.vertexList, self._mode,
+                        self.transform, self._batch)
+        return self.transform
+
+
+    def _meshUpload(self, batch):
+        """Create our vertex list in batch."""
+        self._batch = batch
+        self.vertexList = batch.add(self._count, self._mode, self.transform,
+                *self._attributes)
+        self._attributes = None
+
+
 
 class Layer3d(Layer):
     """A 3-d layer; handles looking into a world and combining the 3d
-    rendering with 2d
+    rendering with 2d.
+
+    Geometry may either be drawn in immediate mode from onDraw3d(), or be
+    added once with addMesh(), after which all of the layer's meshes are
+    drawn as a single batch, one group per MeshTransform.
     """
-    
+
+    _meshBatch = None
+    _meshes = ()
+    _meshes_doc = """Our Meshes; a list once the first is added"""
+
+    def addMesh(self, vertices, mode = GL_TRIANGLES, colors = None,
+            normals = None, transform = None):
+        """Add retained geometry to this layer, and return its Mesh.
+        vertices is a flat sequence of x, y, z coordinates; colors, if given,
+        has 3 or 4 bytes per vertex, and normals 3 floats per vertex.  Move
+        the mesh by changing its transform, rather than re-adding it.
+
+        Meshes that move together should share a MeshTransform, passed as
+        transform, so that they are drawn together."""
+        self._layer3dInitMeshes()
+        if transform is None:
+            mesh = Mesh(mode, vertices, colors, normals, self._meshStatic,
+                    True)
+        else:
+            mesh = Mesh(mode, vertices, colors, normals, transform)
+        self._meshes.append(mesh)
+        self._meshesPending.append(mesh)
+        return mesh
+
+
     def onDraw(self):
         self._go3d()
+        if self._meshes:
+            self._layer3dDrawMeshes()
         self.onDraw3d()
         self._go2d()
-        
-        
+
+
     def onDraw3d(self):
-        """Here's where we should actually do the 3d rendering"""
-        
-        
+        """Here's where we should actually do any immediate-mode 3d
+        rendering; called after the layer's meshes are drawn."""
+
+
+    def removeMesh(self, mesh):
+        """Remove a mesh that was returned by addMesh()."""
+        self._meshes.remove(mesh)
+        if mesh in self._meshesPending:
+            self._meshesPending.remove(mesh)
+        mesh.delete()
+
+
     def _layerInit(self, scene):
         Layer._layerInit(self, scene)
-        
-        # Set up openGL
+
+        # Set up openGL, unless there is no context (running headless, see
+        # Application.run())
+        if pyglet.gl.current_context is None:
+            return
         glClearColor(1, 1, 1, 1)
         glColor3f(1, 0, 0)
-        
+
         glEnable(GL_CULL_FACE)
-        
-        
+
+
+    def _layerInvalidateGeometry(self):
+        Layer._layerInvalidateGeometry(self)
+        self._perspective = None
+
+
     def _go2d(self):
-        glMatrixMode(GL_PROJECTION)
+        if self._scissorBox is not None:
+            w = self.window
+            glState.viewport((0, 0, w.width, w.height))
+        glState.restoreProjection()
         glLoadIdentity()
+        glState.disable(GL_DEPTH_TEST)
+
+
+    def _layer3dDrawMeshes(self):
+        if self._meshesPending:
+            for mesh in self._meshesPending:
+                mesh._meshUpload(self._meshBatch)
+            del self._meshesPending[:]
+        self._meshBatch.draw()
+
+
+    def _layer3dInitMeshes(self):
+        """Set up mesh storage on first use, so that subclasses need not
+        call Layer3d.__init__()."""
+        if self._meshBatch is not None:
+            return
+        self._meshBatch = pyglet.graphics.Batch()
+        self._meshes = []
+        self._meshesPending = []
+        self._meshesPending_doc = """Meshes that will be uploaded the next time
+                we draw (when a GL context is certain to exist)"""
+        self._meshStatic = MeshTransform()
+        self._meshStatic_doc = """The untransformed group shared by meshes
+                added without a transform"""
+
 
-        w = self.window
-        if self.scissorBox is not None:
-            glViewport(0, 0, w.width, w.height)
-        gluOrtho2D(0, w.width, 0, w.height)
-        glMatrixMode(GL_MODELVIEW)
-        glLoadIdentity()
-        glDisable(GL_DEPTH_TEST)
-        
-        
     def _go3d(self):
-        glClearDepth(1.0)
+        glState.clearDepth(1.0)
         glClear(GL_DEPTH_BUFFER_BIT | GL_STENCIL_BUFFER_BIT)
 
-        if self.scissorBox is not None:
-            glViewport(*self.scissorBox)
-        
-        glMatrixMode(GL_PROJECTION)
-        glLoadIdentity()
-        w = self.window
-        gluPerspective(60.0, float(w.width) / w.height, 0.1, 10000.0)
-        glMatrixMode(GL_MODELVIEW)
+        if self._scissorBox is not None:
+            glState.viewport(self._scissorBox)
+
+        self._layerCheckGeometry()
+        if self._perspective is None:
+            w = self.window
+            matrix = perspective(60.0, float(w.width) / w.height, 0.1, 10000.0)
+            self._perspective = (matrix, (GLfloat * 16)(*matrix))
+        glState.setProjection(*self._perspective)
         glLoadIdentity()
-        glDepthFunc(GL_LEQUAL)
-        glEnable(GL_DEPTH_TEST)
-        
-        
-        
+        glState.depthFunc(GL_LEQUAL)
+        glState.enable(GL_DEPTH_TEST)
@@ -42,6 +42,7 @@ except ImportError:
     import __builtin__ as builtins
 
 import operator as _operator
+import re
 import sys
 
 
@@ -440,6 +441,10 @@ class _Builder3:
     def build_NameConstant(self, o):
         return o.value
 
+    def build_Constant(self, o):
+        # Python 3.8+ parses all literals to Constant
+        return o.value
+
     def build_UnaryOp(self, o):
         op, operand = map(self.build, [o.op, o.operand])
         return op(operand)
@@ -465,8 +470,89 @@ class _Builder3:
         return None
 
 
+# Fast path for plain literals, which are nearly all config values: ints,
+# floats, strings without escapes or prefixes, None/True/False, and flat
+# lists and tuples of those.  Anything else goes through the AST builders.
+
+_SCALAR = (r"""'[^'\\\n]*'|"[^"\\\n]*"|"""
+           r"[-+]?(?:\d+\.\d*|\.\d+|\d+)(?:[eE][-+]?\d+)?(?![\w.])|"
+           r"None\b|True\b|False\b")
+_scalar_re = re.compile(r"\s*(%s)\s*\Z" % _SCALAR)
+_items_re = re.compile(r"\s*(?:(?:%s)\s*,\s*)*(?:(?:%s)\s*)?\Z" %
+                       (_SCALAR, _SCALAR))
+_item_re = re.compile(_SCALAR)
+_int_re = re.compile(r"[-+]?\d+\Z")
+_constants = {'None': None, 'True': True, 'False': False}
+
+_memo = {}
+_MEMO_SIZE = 4096
+_NOT_LITERAL = object()
+
+
+def _scalar(token):
+    c = token[0]
+    if c == "'" or c == '"':
+        return token[1:-1]
+    if token in _constants:
+        return _constants[token]
+    if _int_re.match(token):
+        if len(token.lstrip('+-')) > 1 and token.lstrip('+-')[0] == '0':
+            # e.g. 007, an error in Python 3; let the builder decide
+            return _NOT_LITERAL
+        return int(token)
+    return float(token)
+
+
+def _fast_unrepr(s):
+    """Return the value of s if it is a plain literal, else _NOT_LITERAL."""
+    m = _scalar_re.match(s)
+    if m is not None:
+        return _scalar(m.group(1))
+
+    s = s.strip()
+    if len(s) < 2:
+        return _NOT_LITERAL
+    if s[0] == '[' and s[-1] == ']':
+        kind = list
+    elif s[0] == '(' and s[-1] == ')':
+        kind = tuple
+    else:
+        return _NOT_LITERAL
+    inner = s[1:-1]
+    if not _items_re.match(inner):
+        return _NOT_LITERAL
+    items = [_scalar(t) for t in _item_re.findall(inner)]
+    if _NOT_LITERAL in items:
+        return _NOT_LITERAL
+    if kind is tuple and len(items) == 1 and not inner.rstrip().endswith(','):
+        # (x) is just x
+        return items[0]
+    return kind(items)
+
+
 def unrepr(s):
-    """Return a Python object compiled from a string."""
+    """Return a Python object compiled from a string.
+
+    Plain literals are parsed directly, and remembered (up to _MEMO_SIZE
+    distinct strings); lists are copied on the way out, so callers may
+    modify them.  Everything else is evaluated with the AST builders."""
+    if not s:
+        return s
+    value = _memo.get(s, _NOT_LITERAL)
+    if value is _NOT_LITERAL:
+        value = _fast_unrepr(s)
+        if value is _NOT_LITERAL:
+            return _unrepr_ast(s)
+        if len(_memo) >= _MEMO_SIZE:
+            _memo.clear()
+        _memo[s] = value
+    if type(value) is list:
+        return list(value)
+    return value
+
+
+def _unrepr_ast(s):
+    """Return a Python object compiled from a string, via the AST."""
     if not s:
         return s
     if sys.version_info < (3, 0):
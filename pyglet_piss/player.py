@@ -1,5 +1,6 @@
 
 import pyglet
+from pyglet_piss.actionqueue import ActionQueue
 from pyglet_piss.actions import Actions
 
 import six
@@ -10,16 +11,31 @@ class Player(object):
     
     nextId = 0
     nextId_doc = """Incrementing series ID for each player"""
+
+    recorder = None
+    recorder_doc = """If not None, a pyglet_piss.replay.Recorder that every
+            player's startAction() and stopAction() calls are logged to; see
+            Application.startRecording()"""
     
     def __init__(self):
         self.id = Player.nextId
         Player.nextId += 1
-        self.actions = []
-        self.actions_doc = """Actions queued and waiting processing"""
-        self._recurring = {}
-        self._recurring_doc = """Map of { action: Time till recur }"""
+        self.actions = ActionQueue(self.id)
+        self.actions_doc = """ActionQueue of actions (with the time at which
+                each happened) waiting processing"""
+        self.actionsGenerated = 0
+        self.actionsGenerated_doc = """Total number of actions issued by this
+                player"""
+        self.actionsOverflowed = 0
+        self.actionsOverflowed_doc = """Total number of this player's actions
+                that Application dropped for exceeding its per-frame cap"""
         self._buttonMap = {}
         self._buttonMap_doc = """Map of { inputId: Action.BTN id }"""
+        self.recurring = None
+        self.recurring_doc = """The pyglet_piss.recurring.RecurringEngine
+                timing this player's held actions; set by the Application
+                that routes this player's actions.  None until then, in
+                which case actions do not recur."""
         self.x = 0.0
         self.y = 0.0
         
@@ -27,7 +43,7 @@ class Player(object):
     def clearActions(self):
         """Clear all current actions, they have all been processed by UI.
         """
-        self.actions = []
+        self.actions.clear()
         
         
     def poll(self):
@@ -39,7 +55,11 @@ class Player(object):
         already registered as recurring.  In other words, if the player can
         press a button faster than recurring, let them."""
         self.actions.append(action)
-        self._recurring[action] = Actions.RECURRING_MINIMUM
+        self.actionsGenerated += 1
+        if self.recurring is not None:
+            self.recurring.hold(self, action)
+        if Player.recorder is not None:
+            Player.recorder.action(self.id, action)
         
         
     def stopAction(self, action):
@@ -47,72 +67,115 @@ class Player(object):
         recurring keys.  Skip this step if action is not currently part
         of the recurring step; this is only for convenience."""
         self.actions.append(action | Actions.ACTION_STOP_MASK)
-        self._recurring.pop(action, None)
+        self.actionsGenerated += 1
+        if self.recurring is not None:
+            self.recurring.release(self, action)
+        if Player.recorder is not None:
+            Player.recorder.action(self.id, action | Actions.ACTION_STOP_MASK)
         
         
     def update(self, dt):
-        """See if we need to recur anything"""
-        for action, time in self._recurring.items():
-            time -= dt
-            if time < 0:
-                time += Actions.RECURRING_INTERVAL
-                self.actions.append(action)
-            self._recurring[action] = time
+        """Called once per frame after poll().  Recurring actions are timed
+        for all players at once by the Application's recurring engine, and
+        appended to actions after every player is updated."""
 
 
 
 class JoystickPlayer(Player):
-    """Joystick input!"""
+    """Joystick input!
+    
+    Axis and hat motion events only update an analog state buffer; once per
+    frame, poll() turns that state into TAP_* actions.  However many motion
+    events arrive in a frame, a direction issues at most one start or stop
+    action, and only when it actually changes.
+    """
     
+    DEADZONE = 0.15
+    DEADZONE_doc = """Axis values with a magnitude below this read as 0 from
+            axis(), x and y"""
     TAP_THRESHOLD = 0.8
+    TAP_THRESHOLD_doc = """Axis magnitude at which a TAP_* action starts"""
+    TAP_RELEASE = 0.6
+    TAP_RELEASE_doc = """Axis magnitude below which a held TAP_* action stops
+            (hysteresis, so that a stick resting near TAP_THRESHOLD does not
+            chatter)"""
     
     def __init__(self, pygletJoystick):
         Player.__init__(self)
+        self.axes = {}
+        self.axes_doc = """{ axis name: latest raw value } for every axis
+                (including triggers) that has moved, as named by pyglet"""
+        self.hat = (0, 0)
+        self.hat_doc = """Latest (hat_x, hat_y) of the joystick's hat"""
+        self._tapsHeld = {}
+        self._tapsHeld_doc = """{ TAP_* action: True } for each direction
+                currently held"""
+        self._analogDirty = False
+        self._analogDirty_doc = """True if axes or hat changed since the last
+                poll()"""
+        
         self._joystick = pygletJoystick
         self._joystick.open()
         
         self._joystick.set_handler('on_joyaxis_motion', self._onMove)
+        self._joystick.set_handler('on_joyhat_motion', self._onHat)
         self._joystick.set_handler('on_joybutton_press', self._onPress)
         self._joystick.set_handler('on_joybutton_release', self._onRelease)
         
         
+    def axis(self, name):
+        """Returns the value of axis name (e.g. 'x', 'rz'), from -1 to 1,
+        with DEADZONE removed and the remainder rescaled to the full
+        range."""
+        val = self.axes.get(name, 0.0)
+        mag = abs(val)
+        if mag < self.DEADZONE:
+            return 0.0
+        mag = min(1.0, (mag - self.DEADZONE) / (1.0 - self.DEADZONE))
+        return mag if val > 0 else -mag
+        
+        
+    def poll(self):
+        """Evaluate this frame's analog state, issuing TAP_* actions for
+        directions that were pressed or released."""
+        if not self._analogDirty:
+            return
+        self._analogDirty = False
+        
+        self.x = self.axis('x')
+        self.y = self.axis('y')
+        
+        x = self.axes.get('x', 0.0)
+        y = self.axes.get('y', 0.0)
+        hatX, hatY = self.hat
+        # The hat's y points up, the stick's y points down
+        self._pollTap(Actions.TAP_RIGHT, x, hatX > 0)
+        self._pollTap(Actions.TAP_LEFT, -x, hatX < 0)
+        self._pollTap(Actions.TAP_DOWN, y, hatY < 0)
+        self._pollTap(Actions.TAP_UP, -y, hatY > 0)
+        
+        
+    def _onHat(self, joystick, hatX, hatY):
+        self.hat = (hatX, hatY)
+        self._analogDirty = True
+        
+        
     def _onMove(self, joystick, axis, val):
-        if axis == 'x':
-            o = self.x
-            self.x = val
-            if val >= self.TAP_THRESHOLD:
-                # Possible tap right?
-                if o < self.TAP_THRESHOLD:
-                    self.startAction(Actions.TAP_RIGHT)
-            else:
-                # No longer 
-                self.stopAction(Actions.TAP_RIGHT)
-                
-            if val <= -self.TAP_THRESHOLD:
-                # Possible tap left?
-                if o > -self.TAP_THRESHOLD:
-                    self.startAction(Actions.TAP_LEFT)
-            else:
-                # No longer 
-                self.stopAction(Actions.TAP_LEFT)
-        elif axis == 'y':
-            o = self.y
-            self.y = val
-            if val >= self.TAP_THRESHOLD:
-                # Possible tap down?
-                if o < self.TAP_THRESHOLD:
-                    self.startAction(Actions.TAP_DOWN)
-            else:
-                # No longer 
-                self.stopAction(Actions.TAP_DOWN)
-                
-            if val <= -self.TAP_THRESHOLD:
-                # Possible tap up?
-                if o > -self.TAP_THRESHOLD:
-                    self.startAction(Actions.TAP_UP)
-            else:
-                # No longer 
-                self.stopAction(Actions.TAP_UP)
+        self.axes[axis] = val
+        self._analogDirty = True
+        
+        
+    def _pollTap(self, action, val, hat):
+        """Start or stop action, given the axis value in its direction and
+        whether the hat points that way."""
+        held = self._tapsHeld.get(action, False)
+        if held:
+            if not hat and val < self.TAP_RELEASE:
+                del self._tapsHeld[action]
+                self.stopAction(action)
+        elif hat or val >= self.TAP_THRESHOLD:
+            self._tapsHeld[action] = True
+            self.startAction(action)
     
     
     def _onPress(self, joystick, button):
@@ -130,22 +193,48 @@ class KeyboardPlayer(Player):
     
     def __init__(self, mappings):
         Player.__init__(self)
+        self.mappings = None
+        self.mappings_doc = """The config section that this player's keys
+                were bound from"""
+        self.setMappings(mappings)
+            
+        # Input handling is bound in application init
+            
+            
+    def setMappings(self, mappings):
+        """Rebind this player's keys from mappings, a { ACTION: KEY } config
+        section, where KEY is a pyglet.window.key name or a key code.  The
+        new bindings replace the old all at once; a bad mapping raises
+        ValueError and leaves the old bindings in place."""
+        buttonMap = {}
         for m, v in six.iteritems(mappings):
-            action = m.upper()
-            key = v.upper()
+            if m == 'replaceWithJoystick':
+                # Used by Application, not a mapping
+                continue
             
             # resolve key to enum'd value, if possible.
-            try:
-                key = int(key)
-            except ValueError:
-                key = pyglet.window.key.__dict__[key]
+            if isinstance(v, six.integer_types) and not isinstance(v, bool):
+                key = v
+            elif isinstance(v, six.string_types):
+                key = v.upper()
+                try:
+                    key = int(key)
+                except ValueError:
+                    key = getattr(pyglet.window.key, key, None)
+            else:
+                key = None
+            if not isinstance(key, six.integer_types):
+                raise ValueError("Bad key for {0}: {1!r}".format(m, v))
                 
             # resolve action
-            action = Actions.__dict__[action]
+            action = Actions.__dict__.get(m.upper())
+            if not isinstance(action, six.integer_types):
+                raise ValueError("Unknown action: {0!r}".format(m))
             
-            self._buttonMap[key] = action
+            buttonMap[key] = action
             
-        # Input handling is bound in application init
+        self._buttonMap = buttonMap
+        self.mappings = mappings
             
             
     def _onPress(self, key, modifiers):
@@ -0,0 +1,136 @@
+
+from pyglet_piss.actionqueue import now
+
+import array
+import pyglet
+import six
+
+class _Samples(object):
+    """Fixed-size ring buffer of timings, in seconds."""
+
+    def __init__(self, size):
+        self.values = array.array('d', [ 0.0 ]) * size
+        self.count = 0
+        self.last = 0.0
+        self._next = 0
+
+
+    def add(self, seconds):
+        self.values[self._next] = seconds
+        self._next += 1
+        if self._next == len(self.values):
+            self._next = 0
+        if self.count < len(self.values):
+            self.count += 1
+        self.last = seconds
+
+
+    def sorted(self):
+        return sorted(self.values[:self.count])
+
+
+
+class Profiler(object):
+    """Records the wall-clock time of each phase of each frame: Player.poll,
+    action dispatch, each scene's onUpdate, and each layer's onUpdate,
+    preDraw, onDraw (including its batch) and postDraw.  The most recent
+    samples of each phase are kept in fixed-size ring buffers.
+
+    Enable by assigning an instance to Application.profiler, or with the
+    [profile] config section (see Application.run()).  Set Scene.showProfile
+    to draw a per-layer bar overlay.
+    """
+
+    OVERLAY_BUDGET = 1.0 / 60
+    OVERLAY_BUDGET_doc = """Seconds represented by a full-width overlay bar"""
+
+    def __init__(self, samples = 600):
+        self.samples = samples
+        self.samples_doc = """Number of recent samples kept for each phase"""
+        self._phases = {}
+        self._labels = {}
+
+
+    def dump(self, fname):
+        """Write the p50, p95, and p99 times of every phase, in
+        milliseconds, to fname."""
+        lines = [ '{0:<48} {1:>8} {2:>8} {3:>8} {4:>8}\n'.format('phase',
+                'samples', 'p50', 'p95', 'p99') ]
+        for key in sorted(self._phases):
+            p50, p95, p99 = self.percentiles(key)
+            lines.append('{0:<48} {1:>8} {2:>8.3f} {3:>8.3f} {4:>8.3f}\n'
+                    .format(key, self._phases[key].count, p50 * 1000.0,
+                        p95 * 1000.0, p99 * 1000.0))
+        with open(fname, 'w') as f:
+            f.write(''.join(lines))
+
+
+    def drawOverlay(self, scene):
+        """Draw one bar per layer in scene, in window pixel coordinates,
+        showing the time its update and draw phases took last frame."""
+        rows = []
+        for l in scene._layers:
+            total = 0.0
+            for k in l._layerProfileKeys:
+                s = self._phases.get(k)
+                if s is not None:
+                    total += s.last
+            rows.append((l._layerProfileName, total))
+
+        width = scene.width * 0.5
+        rowHeight = 14
+        y = scene.height - rowHeight * (len(rows) + 1)
+        vertices = []
+        for name, total in rows:
+            w = max(1.0, min(1.0, total / self.OVERLAY_BUDGET) * width)
+            vertices.extend([ 0, y, w, y, w, y + rowHeight - 2,
+                    0, y + rowHeight - 2 ])
+            label = self._labels.get(name)
+            if label is None:
+                label = self._labels[name] = pyglet.text.Label(name,
+                        font_size = 8, anchor_y = 'bottom')
+            label.text = '{0} {1:.2f}ms'.format(name, total * 1000.0)
+            label.x = 2
+            label.y = y
+            y += rowHeight
+
+        if vertices:
+            pyglet.gl.glColor4f(0.8, 0.2, 0.2, 0.6)
+            pyglet.graphics.draw(len(vertices) // 2, pyglet.gl.GL_QUADS,
+                    ('v2f', vertices))
+            pyglet.gl.glColor4f(1, 1, 1, 1)
+        for name, total in rows:
+            self._labels[name].draw()
+
+
+    def percentiles(self, key, percents = (50, 95, 99)):
+        """Returns the given percentiles (nearest-rank) of phase key's recent
+        samples, in seconds."""
+        values = self._phases[key].sorted()
+        if not values:
+            return [ 0.0 for p in percents ]
+        n = len(values)
+        return [ values[min(n - 1, max(0, int(n * p / 100.0 + 0.5) - 1))]
+                for p in percents ]
+
+
+    def phases(self):
+        """Returns the names of all phases recorded so far."""
+        return list(six.iterkeys(self._phases))
+
+
+    def record(self, key, seconds):
+        """Record that phase key took seconds."""
+        s = self._phases.get(key)
+        if s is None:
+            s = self._phases[key] = _Samples(self.samples)
+        s.add(seconds)
+
+
+    def time(self, key, f, *args):
+        """Call f(*args), recording its duration as phase key.  Returns f's
+        result."""
+        start = now()
+        r = f(*args)
+        self.record(key, now() - start)
+        return r
@@ -0,0 +1,225 @@
+
+from pyglet_piss.actions import Actions
+
+import array
+import six
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+class RecurringEngine(object):
+    """Times the recurrence of every held action, for all players at once.
+
+    Held actions are kept in parallel arrays - the holding player, the action
+    code, the time remaining until it next recurs, and its recurrence
+    interval - and update() advances all of them in a single pass.  With
+    NumPy available and at least NUMPY_THRESHOLD held actions, that pass is
+    vectorized.
+
+    When an action is started, it first recurs after its minimum time, and
+    then every interval seconds while it is held (at most once per update).
+    Both may be set per action; see setTiming() and configure().  Actions
+    without their own timing follow Actions.RECURRING_MINIMUM, read when the
+    action is started, and Actions.RECURRING_INTERVAL, read each time it
+    recurs, so that changes to either take effect as they always have.
+
+    Each Application has its own engine (Application.recurring), which it
+    gives to the players it routes actions for, and which only ever issues
+    recurrences to those players.
+    """
+
+    NUMPY_THRESHOLD = 64
+    NUMPY_THRESHOLD_doc = """Held actions at which update() switches to
+            NumPy, if available"""
+
+    def __init__(self):
+        self.defaultTiming = None
+        self.defaultTiming_doc = """(minimum, interval) for actions without
+                their own timing, as set by setTiming(None, ...), or None to
+                follow Actions.RECURRING_MINIMUM and RECURRING_INTERVAL"""
+        self.players = []
+        self.players_doc = """The player holding each slot's action"""
+        self.actions = array.array('i')
+        self.actions_doc = """Held action code for each slot"""
+        self.remaining = array.array('d')
+        self.remaining_doc = """Seconds until each slot's action recurs"""
+        self.intervals = array.array('d')
+        self.intervals_doc = """Recurrence interval of each slot's action, or
+                -1 to use Actions.RECURRING_INTERVAL as it is when the action
+                recurs"""
+        self._slots = {}
+        self._slots_doc = """{ (player id, action): slot index }"""
+        self._timings = {}
+        self._timings_doc = """{ action: (minimum, interval) } overriding the
+                defaults"""
+
+
+    def __len__(self):
+        return len(self.actions)
+
+
+    def configure(self, section):
+        """Apply a [recurring] config section, whose keys are action names
+        (e.g. TAP_LEFT) or 'default', and whose values are
+        (minimum, interval) in seconds, or None so that the action never
+        recurs."""
+        for name, timing in six.iteritems(section):
+            if name.lower() == 'default':
+                action = None
+            else:
+                action = getattr(Actions, name.upper())
+            if timing is None:
+                self.setTiming(action, None)
+            else:
+                self.setTiming(action, *timing)
+
+
+    def forget(self, player):
+        """Stop timing all of player's held actions, e.g. when the player is
+        removed."""
+        i = len(self.players) - 1
+        while i >= 0:
+            if self.players[i] is player:
+                self._remove(i)
+            i -= 1
+
+
+    def hold(self, player, action):
+        """Start timing the recurrence of player's action, restarting it if
+        already held."""
+        minimum, interval = self._timingStored(action)
+        key = (player.id, action)
+        slot = self._slots.get(key)
+        if minimum is None:
+            if slot is not None:
+                self._remove(slot)
+            return
+        if slot is None:
+            self._slots[key] = len(self.actions)
+            self.players.append(player)
+            self.actions.append(action)
+            self.remaining.append(minimum)
+            self.intervals.append(interval)
+        else:
+            self.remaining[slot] = minimum
+            self.intervals[slot] = interval
+
+
+    def release(self, player, action):
+        """Stop the recurrence of player's action, if held."""
+        slot = self._slots.get((player.id, action))
+        if slot is not None:
+            self._remove(slot)
+
+
+    def setTiming(self, action, minimum, interval = None):
+        """Set the seconds before action first recurs, and between later
+        recurrences.  action None sets the defaults for all actions without
+        their own timing; minimum None stops action from recurring at all.
+        interval defaults to the default interval.  Actions already held
+        keep their current timing until started again."""
+        if interval is None:
+            interval = self.timing(None)[1]
+        if action is None:
+            self.defaultTiming = (minimum, interval)
+        else:
+            self._timings[action] = (minimum, interval)
+
+
+    def timing(self, action):
+        """Returns (minimum, interval) for action, or the default timing if
+        action is None."""
+        t = self._timings.get(action)
+        if t is None:
+            t = self.defaultTiming
+            if t is None:
+                return (Actions.RECURRING_MINIMUM, Actions.RECURRING_INTERVAL)
+        return t
+
+
+    def update(self, dt, players = None):
+        """Advance every held action by dt, and append the actions that
+        recur to their players' action queues.  If players is given, held
+        actions of any other player are forgotten first."""
+        if players is not None and len(self.actions):
+            self._forgetOthers(players)
+        n = len(self.actions)
+        if n == 0:
+            return
+        if numpy is not None and n >= self.NUMPY_THRESHOLD:
+            self._updateNumpy(dt)
+            return
+
+        players = self.players
+        actions = self.actions
+        remaining = self.remaining
+        intervals = self.intervals
+        for i in range(n):
+            r = remaining[i] - dt
+            if r < 0:
+                interval = intervals[i]
+                if interval < 0:
+                    interval = Actions.RECURRING_INTERVAL
+                r += interval
+                p = players[i]
+                p.actions.append(actions[i])
+                p.actionsGenerated += 1
+            remaining[i] = r
+
+
+    def _forgetOthers(self, players):
+        """Forget the held actions of every player not in players."""
+        ids = set([ p.id for p in players ])
+        i = len(self.players) - 1
+        while i >= 0:
+            if self.players[i].id not in ids:
+                self._remove(i)
+            i -= 1
+
+
+    def _remove(self, slot):
+        """Remove slot, moving the last slot into its place."""
+        players = self.players
+        last = len(players) - 1
+        del self._slots[(players[slot].id, self.actions[slot])]
+        if slot != last:
+            players[slot] = players[last]
+            self.actions[slot] = self.actions[last]
+            self.remaining[slot] = self.remaining[last]
+            self.intervals[slot] = self.intervals[last]
+            self._slots[(players[slot].id, self.actions[slot])] = slot
+        players.pop()
+        self.actions.pop()
+        self.remaining.pop()
+        self.intervals.pop()
+
+
+    def _timingStored(self, action):
+        """Returns timing(action), with an interval of -1 if it should follow
+        Actions.RECURRING_INTERVAL."""
+        t = self._timings.get(action)
+        if t is None:
+            t = self.defaultTiming
+            if t is None:
+                return (Actions.RECURRING_MINIMUM, -1.0)
+        return t
+
+
+    def _updateNumpy(self, dt):
+        remaining = numpy.frombuffer(self.remaining, dtype = numpy.float64)
+        remaining -= dt
+        fired = numpy.flatnonzero(remaining < 0)
+        if len(fired) == 0:
+            return
+        intervals = numpy.frombuffer(self.intervals,
+                dtype = numpy.float64)[fired]
+        remaining[fired] += numpy.where(intervals < 0,
+                Actions.RECURRING_INTERVAL, intervals)
+        players = self.players
+        actions = self.actions
+        for i in fired.tolist():
+            p = players[i]
+            p.actions.append(actions[i])
+            p.actionsGenerated += 1
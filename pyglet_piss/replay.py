@@ -0,0 +1,160 @@
+
+from pyglet_piss.actions import Actions
+from pyglet_piss.player import Player
+
+import six
+import struct
+
+MAGIC = b'PISR'
+VERSION = 1
+
+_HEADER = struct.Struct('<4sH')
+_PLAYER = struct.Struct('<BH')
+_ACTION = struct.Struct('<BHH')
+_FRAME = struct.Struct('<BId')
+
+_TAG_PLAYER = ord('P')
+_TAG_ACTION = ord('A')
+_TAG_FRAME = ord('F')
+
+class Recorder(object):
+    """Writes a compact binary log of player input, for replay with Replay.
+
+    The log is a header (MAGIC, VERSION) followed by little-endian records,
+    each starting with a one-byte tag:
+        'P' playerId (uint16) - A player that existed when recording began.
+        'A' playerId (uint16), action (uint16) - A startAction() or
+                stopAction() (stops have Actions.ACTION_STOP_MASK set).
+        'F' frameIndex (uint32), dt (float64) - The end of a frame; every
+                action since the previous 'F' record was delivered in it.
+
+    Recurrences are not logged; they follow from the actions and dts.
+    """
+
+    FLUSH_SIZE = 64 * 1024
+    FLUSH_SIZE_doc = """Buffered bytes at which the log is written out"""
+
+    def __init__(self, fname, players = ()):
+        self.fname = fname
+        self.frames = 0
+        self.frames_doc = """Number of frames recorded so far"""
+        self._file = open(fname, 'wb')
+        self._buffer = bytearray(_HEADER.pack(MAGIC, VERSION))
+        for p in players:
+            self._buffer += _PLAYER.pack(_TAG_PLAYER, p.id)
+
+
+    def action(self, playerId, action):
+        """Record that playerId started or stopped action."""
+        self._buffer += _ACTION.pack(_TAG_ACTION, playerId, action)
+
+
+    def close(self):
+        """Write out anything buffered and close the log."""
+        if self._file is None:
+            return
+        self.flush()
+        self._file.close()
+        self._file = None
+
+
+    def flush(self):
+        self._file.write(bytes(self._buffer))
+        del self._buffer[:]
+
+
+    def frame(self, frameIndex, dt):
+        """Record the end of frame frameIndex, which advanced time by dt."""
+        self._buffer += _FRAME.pack(_TAG_FRAME, frameIndex, dt)
+        self.frames += 1
+        if len(self._buffer) >= self.FLUSH_SIZE:
+            self.flush()
+
+
+
+class ReplayPlayer(Player):
+    """A player that issues the actions of one recorded player.  Replay
+    queues each frame's actions before Application.update(); they are
+    issued from poll(), in their recorded order."""
+
+    def __init__(self, recordedId):
+        Player.__init__(self)
+        self.recordedId = recordedId
+        self.recordedId_doc = """The id of the player in the recording"""
+        self._pending = []
+
+
+    def poll(self):
+        for action in self._pending:
+            if action & Actions.ACTION_STOP_MASK:
+                self.stopAction(action & ~Actions.ACTION_STOP_MASK)
+            else:
+                self.startAction(action)
+        del self._pending[:]
+
+
+
+class Replay(object):
+    """A recording loaded from a Recorder's log.  See
+    Application.replay() to run one."""
+
+    def __init__(self, fname):
+        with open(fname, 'rb') as f:
+            data = f.read()
+        magic, version = _HEADER.unpack_from(data, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError("{0} is not a version {1} input recording"
+                    .format(fname, VERSION))
+
+        self.players = []
+        self.players_doc = """A ReplayPlayer for each recorded player, in the
+                order that they were recorded"""
+        self.frames = []
+        self.frames_doc = """List of (dt, [ (recordedId, action) ]) for each
+                recorded frame"""
+        byId = {}
+        actions = []
+        pos = _HEADER.size
+        end = len(data)
+        while pos < end:
+            tag = six.indexbytes(data, pos)
+            if tag == _TAG_ACTION:
+                _, playerId, action = _ACTION.unpack_from(data, pos)
+                pos += _ACTION.size
+                if playerId not in byId:
+                    byId[playerId] = ReplayPlayer(playerId)
+                    self.players.append(byId[playerId])
+                actions.append((playerId, action))
+            elif tag == _TAG_FRAME:
+                _, frameIndex, dt = _FRAME.unpack_from(data, pos)
+                pos += _FRAME.size
+                self.frames.append((dt, actions))
+                actions = []
+            elif tag == _TAG_PLAYER:
+                _, playerId = _PLAYER.unpack_from(data, pos)
+                pos += _PLAYER.size
+                if playerId not in byId:
+                    byId[playerId] = ReplayPlayer(playerId)
+                    self.players.append(byId[playerId])
+            else:
+                raise ValueError("Bad record tag {0} at byte {1} of {2}"
+                        .format(tag, pos, fname))
+        self._byId = byId
+
+
+    def play(self, app):
+        """Feed every recorded frame through app.update() as fast as
+        possible, with this recording's players as app.players.  Returns the
+        number of frames played, which is fewer than len(self.frames) if
+        the application ran out of scenes first."""
+        app.players = list(self.players)
+        byId = self._byId
+        played = 0
+        for dt, actions in self.frames:
+            if app._exiting:
+                break
+            for playerId, action in actions:
+                byId[playerId]._pending.append(action)
+            app.update(dt)
+            played += 1
+        return played
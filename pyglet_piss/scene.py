@@ -1,5 +1,7 @@
 
+from .actionqueue import now
 from .common import frameCachedProperty
+from .glstate import state as glState
 
 import pyglet
 from pyglet_piss.layer import Layer
@@ -8,21 +10,46 @@ class Scene(object):
     """A scene is a collection of layers that make up a single user experience.
     """
 
+    redrawOnChange = False
+    redrawOnChange_doc = """Set to True to only redraw this scene after
+            invalidate() has been called (or the window was resized or
+            exposed), rather than at every opportunity.  For scenes that
+            rarely change, e.g. on a secondary display."""
+
     showFps = False
     showFps_doc = """Set to True to show the FPS in the lower-left corner"""
 
+    showProfile = False
+    showProfile_doc = """Set to True to draw a bar per layer showing how long
+            it took to update and draw, when the application is profiling
+            (see Application.profiler)"""
+
+    targetFps = None
+    targetFps_doc = """Rate at which to draw this scene's window while it is
+            the window's top scene, or None to use the window's own rate
+            ([display] targetFps)"""
+
+    _sceneCount = 0
+    _sceneCount_doc = """Number of scenes ever initialized; used to name
+            scenes in profiles"""
+
+    updateAlpha = 1.0
+    updateAlpha_doc = """When the application runs with a fixed timestep
+            ([loop] fixedUpdateHz), the fraction of a step (0 to 1) that has
+            elapsed since the last update.  Draw code may interpolate between
+            the previous and current simulation states with it.  Always 1.0
+            with a variable timestep."""
+
     @property
-    @frameCachedProperty
     def height(self):
         """Returns the window height"""
-        return self._window.height
+        return self._height
 
 
     @property
-    @frameCachedProperty
     def width(self):
         """Returns the window width"""
-        return self._window.width
+        return self._width
 
 
     @property
@@ -33,12 +60,31 @@ class Scene(object):
     def __init__(self):
         self._layers = []
         self._isInit = False
+        self._width = 0
+        self._height = 0
+        self._actionIndex = {}
+        self._actionIndex_doc = """{ action: [ handler ] }, top layer first,
+                for every action that some layer declared a handler for"""
+        self._actionGeneric = []
+        self._actionGeneric_doc = """[ handler ], top layer first, for all
+                other actions (overridden Layer.onAction methods)"""
+        self._sceneInvalid = True
+        self._sceneInvalid_doc = """True if the scene has changed since it was
+                last drawn; see redrawOnChange"""
 
 
     def addLayer(self, layer):
         self._layers.append(layer)
         if layer.scene != self:
             layer._layerInit(self)
+        self._sceneCompileActions()
+        self._sceneInvalid = True
+
+
+    def invalidate(self):
+        """Note that the scene has changed and should be redrawn; needed
+        only when redrawOnChange is set."""
+        self._sceneInvalid = True
 
 
     def onAction(self, player, action):
@@ -70,35 +116,99 @@ class Scene(object):
 
     def removeLayer(self, layer):
         self._layers.remove(layer)
+        self._sceneCompileActions()
+        self._sceneInvalid = True
 
 
     def _sceneAction(self, player, action):
-        """Call onAction() for each layer until one returns True.  This method
-        is called by the Application.
+        """Call each layer's handlers for action, from the top layer down,
+        until one returns True.  This method is called by the Application.
         """
-        i = len(self._layers)
-        while i > 0:
-            i -= 1
-            r = self._layers[i].onAction(player, action)
-            if r is True:
-                return r
+        for handler in self._actionIndex.get(action, self._actionGeneric):
+            if handler(player, action) is True:
+                return True
         return self.onAction(player, action)
 
 
-    def _sceneDraw(self):
-        """Draw self, then all layers"""
+    def _sceneCompileActions(self):
+        """Rebuild the per-action dispatch index from our layers.  Called
+        whenever layers are added or removed."""
+        layerHandlers = [ l._layerActionHandlers()
+                for l in reversed(self._layers) ]
+        actions = set()
+        for specific, generic in layerHandlers:
+            actions.update(specific)
+
+        index = dict([ (a, []) for a in actions ])
+        genericHandlers = []
+        for specific, generic in layerHandlers:
+            for a in actions:
+                handlers = index[a]
+                handlers.extend(specific.get(a, ()))
+                if generic is not None:
+                    handlers.append(generic)
+            if generic is not None:
+                genericHandlers.append(generic)
+
+        # Rebind rather than mutate, so that a dispatch in progress (e.g. a
+        # handler that removed its own layer) continues with the old lists
+        self._actionIndex = index
+        self._actionGeneric = genericHandlers
+
+
+    def _sceneDraw(self, profiler = None):
+        """Draw self, then all layers.  If profiler is given, the time of
+        each layer's drawing phases is recorded to it."""
         self.preDraw()
         self.onDraw()
+
+        # Each window has its own GL context, so start from the state that
+        # scenes leave behind
+        glState.reset()
         for l in self._layers:
-            l.preDraw()
-            l.onDraw()
-            l.postDraw()
+            self._sceneDrawLayer(l, profiler)
+
+        # Restore the state that our layers left in place for one another
+        glState.scissor(None)
+        glState.restoreProjection()
         self.postDraw()
 
         if self.showFps:
+            if self.__fps is None:
+                self.__fps = pyglet.clock.ClockDisplay()
             self.__fps.draw()
+        if self.showProfile and profiler is not None:
+            profiler.drawOverlay(self)
 
-        frameCachedProperty.clear(self)
+        # Start a new frame generation for any frameCachedProperty values
+        frameCachedProperty.clear()
+        self._sceneInvalid = False
+
+
+    def _sceneDrawLayer(self, l, profiler = None):
+        """Draw layer l.  If profiler is given, its preDraw, onDraw (with
+        its batch) and postDraw are each recorded as their own phase."""
+        if profiler is None:
+            l.preDraw()
+            l.onDraw()
+            if l._batch is not None:
+                l._batch.draw()
+            l.postDraw()
+            return
+
+        keys = l._layerProfileKeys
+        t0 = now()
+        l.preDraw()
+        t1 = now()
+        l.onDraw()
+        if l._batch is not None:
+            l._batch.draw()
+        t2 = now()
+        l.postDraw()
+        t3 = now()
+        profiler.record(keys[1], t1 - t0)
+        profiler.record(keys[2], t2 - t1)
+        profiler.record(keys[3], t3 - t2)
 
 
     def _sceneInit(self, window):
@@ -108,28 +218,58 @@ class Scene(object):
 
         self._isInit = True
         self._window = window
-        self.__fps = pyglet.clock.ClockDisplay()
 
-
-    def _sceneUpdate(self, dt):
-        """Calculate input, trigger actions, and then do any necessary updates.
-        """
-        # Input loop - look for new actions, map them, and reset
-        for player in self.window.app.players:
-            for action in player.actions:
-                self._sceneAction(player, action)
-
-        # Run update methods
-        firstLayer = None
-        for i, l in reversed(list(enumerate(self._layers))):
-            if l.suspendsLower:
-                firstLayer = i
+        Scene._sceneCount += 1
+        self._sceneProfileKey = '{0}#{1}.onUpdate'.format(
+                type(self).__name__, Scene._sceneCount)
+        self._sceneResize(window.width, window.height)
+        self.__fps = None
+
+
+    def _sceneComputeUpdateRange(self):
+        """Find the topmost layer that suspends lower layers' updates, and
+        return its index (None if none does).  Called on every update, since
+        suspendsLower may change at any time; the scan stops at the first
+        suspending layer from the top, so it only visits layers that update
+        anyway."""
+        layers = self._layers
+        start = None
+        i = len(layers)
+        while i > 0:
+            i -= 1
+            if layers[i].suspendsLower:
+                start = i
                 break
+        return start
 
-        if firstLayer is None:
-            self.onUpdate(dt)
-            for l in self._layers:
-                l.onUpdate(dt)
-        else:
-            for l in self._layers[i:]:
+
+    def _sceneResize(self, width, height):
+        """Called when our window's size changes; invalidates the geometry of
+        all of our layers."""
+        self._width = width
+        self._height = height
+        self._sceneInvalid = True
+        for l in self._layers:
+            l._layerInvalidateGeometry()
+
+
+    def _sceneUpdate(self, dt, profiler = None):
+        """Do any necessary updates.  Input has already been routed to this
+        scene by the Application.  If profiler is given, the time of our
+        onUpdate and each layer's is recorded to it.
+        """
+        layers = self._layers
+        i = self._sceneComputeUpdateRange()
+        if i is None:
+            if profiler is None:
+                self.onUpdate(dt)
+            else:
+                profiler.time(self._sceneProfileKey, self.onUpdate, dt)
+            i = 0
+        while i < len(layers):
+            l = layers[i]
+            if profiler is None:
                 l.onUpdate(dt)
+            else:
+                profiler.time(l._layerProfileKeys[0], l.onUpdate, dt)
+            i += 1
@@ -0,0 +1,39 @@
+
+from pyglet_piss.actionqueue import now
+
+import pyglet
+import pyglet.app
+
+class WindowScheduler(pyglet.app.EventLoop):
+    """Replaces pyglet's event loop, which redraws every window on every
+    tick, so that each window is drawn at its own target rate (see
+    _ApplicationWindow.targetFps), and not at all while its scene has
+    redrawOnChange set and has not been invalidated.
+
+    A window's draw time, including its buffer flip, is kept as its
+    frameTime, so that a slow secondary display can be spotted; it is also
+    recorded to Application.profiler, if any, as windowN.draw.  Windows
+    that have been closed are skipped, as pyglet's own loop does.
+    """
+
+    def __init__(self, app):
+        pyglet.app.EventLoop.__init__(self)
+        self._app = app
+
+
+    def idle(self):
+        dt = self.clock.update_time()
+        self.clock.call_scheduled_functions(dt)
+
+        t = now()
+        wait = self.clock.get_sleep_time(True)
+        for aw in self._app._windows:
+            w = aw._window
+            if w.context is None or w not in pyglet.app.windows:
+                # Closed by the user; drawing now would go to whichever
+                # other window's context is current
+                continue
+            untilDue = aw._windowDrawIfDue(t)
+            if untilDue is not None and (wait is None or untilDue < wait):
+                wait = untilDue
+        return wait
@@ -0,0 +1,159 @@
+
+from pyglet_piss.config import Config, DELETED
+
+import os
+import shutil
+import tempfile
+import unittest
+
+class TestConfigSections(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+
+    def _write(self, name, text):
+        fname = os.path.join(self.dir, name)
+        with open(fname, 'w') as f:
+            f.write(text)
+        return fname
+
+
+    def testLaterMergeWins(self):
+        c = Config()
+        c.merge({ 'display': { 'width': 800 } })
+        c.merge({ 'display': { 'width': 640 } })
+        self.assertEqual(640, c['display']['width'])
+
+
+    def testMergeWinsOverLocal(self):
+        c = Config()
+        c.merge({ 'display': { 'width': 800, 'height': 600 } })
+        c.set('display', 'width', 1024)
+        c.set('display', 'height', 768)
+        c.merge({ 'display': { 'width': 640 } })
+        self.assertEqual(640, c['display']['width'])
+        self.assertEqual(768, c['display']['height'])
+
+
+    def testLocalWinsOverEarlierMerge(self):
+        c = Config()
+        c.merge({ 'display': { 'width': 800 } })
+        c['display']['width'] = 1024
+        self.assertEqual(1024, c['display']['width'])
+
+
+    def testDelMergedKey(self):
+        c = Config()
+        c.merge({ 'a': { 'x': 1, 'y': 2 } })
+        del c['a']['x']
+        self.assertNotIn('x', c['a'])
+        self.assertEqual({ 'y': 2 }, c['a'].copy())
+        self.assertRaises(KeyError, c['a'].__delitem__, 'x')
+
+
+    def testDelShadowedKey(self):
+        c = Config()
+        c.merge({ 'a': { 'x': 1 } })
+        c.set('a', 'x', 2)
+        del c['a']['x']
+        self.assertNotIn('x', c['a'])
+
+
+    def testPopMergedKey(self):
+        c = Config()
+        c.merge({ 'a': { 'x': 1 } })
+        self.assertEqual(1, c['a'].pop('x', 5))
+        self.assertEqual(5, c['a'].pop('x', 5))
+        self.assertRaises(KeyError, c['a'].pop, 'x')
+
+
+    def testUnsetPlainDictSection(self):
+        c = Config({ 'a': { 'x': 1, 'y': 2 } })
+        c.unset('a', 'x')
+        self.assertEqual({ 'y': 2 }, dict(c['a']))
+        self.assertRaises(KeyError, c.unset, 'a', 'x')
+
+
+    def testMergeRevivesDeletedKey(self):
+        c = Config()
+        c.merge({ 'a': { 'x': 1 } })
+        del c['a']['x']
+        c.merge({ 'a': { 'x': 3 } })
+        self.assertEqual(3, c['a']['x'])
+
+
+    def testUnmergeDropsSection(self):
+        c = Config()
+        h = c.merge({ 'a': { 'x': 1 } })
+        del c['a']['x']
+        c.unmerge(h)
+        self.assertNotIn('a', c)
+
+
+    def testUnmergeRevealsOlder(self):
+        c = Config()
+        c.merge({ 'a': { 'x': 1 } })
+        h = c.merge({ 'a': { 'x': 2 } })
+        c.unmerge(h)
+        self.assertEqual(1, c['a']['x'])
+
+
+    def testDeleteNotifies(self):
+        c = Config()
+        c.merge({ 'a': { 'x': 1 } })
+        seen = []
+        c.subscribe(lambda config, section, changes:
+                seen.append((section, changes)))
+        del c['a']['x']
+        self.assertEqual([ ('a', { 'x': DELETED }) ], seen)
+
+
+    def testReloadWinsOverLocal(self):
+        fname = self._write('game.ini', '[display]\nwidth = 800\n'
+                'height = 600\n')
+        c = Config()
+        c.snapshots = False
+        c.merge(fname)
+        c.set('display', 'width', 1024)
+        c.set('display', 'height', 768)
+        self._write('game.ini', '[display]\nwidth = 640\nheight = 600\n')
+        c.reload(fname)
+        self.assertEqual(640, c['display']['width'])
+        # Unchanged in the file, so the local value stays
+        self.assertEqual(768, c['display']['height'])
+
+
+    def testReloadKeepsOrder(self):
+        first = self._write('first.ini', '[a]\nx = 1\n')
+        second = self._write('second.ini', '[a]\nx = 2\n')
+        c = Config()
+        c.snapshots = False
+        c.merge(first)
+        c.merge(second)
+        self._write('first.ini', '[a]\nx = 3\n')
+        c.reload(first)
+        self.assertEqual(2, c['a']['x'])
+
+
+
+    def testSaveNoticesInPlaceChange(self):
+        fname = os.path.join(self.dir, 'scores.ini')
+        c = Config()
+        c.merge({ 'scores': { 'high': [ 10 ] }, 'a': { 'x': 1 } })
+        c.save(fname)
+        c['scores']['high'].append(20)
+        c.save(fname)
+        d = Config()
+        d.snapshots = False
+        d.merge(fname)
+        self.assertEqual([ 10, 20 ], d['scores']['high'])
+        self.assertEqual(1, d['a']['x'])
+
+
+
+if __name__ == '__main__':
+    unittest.main()
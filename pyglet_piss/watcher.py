@@ -0,0 +1,227 @@
+
+from pyglet_piss.config import loadIni
+
+import ctypes
+import ctypes.util
+import os
+import select
+import six
+import struct
+import threading
+
+_EVENT = struct.Struct('iIII')
+
+class _Inotify(object):
+    """Minimal inotify(7) binding through libc; raises OSError where inotify
+    is not available."""
+
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_TO = 0x00000080
+    IN_NONBLOCK = os.O_NONBLOCK
+
+    def __init__(self):
+        libName = ctypes.util.find_library('c')
+        if libName is None:
+            raise OSError("No libc")
+        libc = ctypes.CDLL(libName, use_errno = True)
+        if not hasattr(libc, 'inotify_init1'):
+            raise OSError("No inotify")
+        self._libc = libc
+        self.fd = libc.inotify_init1(self.IN_NONBLOCK)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+
+
+    def addWatch(self, path):
+        # Not IN_CREATE: a file just created is still empty or half
+        # written, and would be parsed as such
+        mask = self.IN_CLOSE_WRITE | self.IN_MOVED_TO
+        if not isinstance(path, bytes):
+            path = path.encode('utf-8')
+        wd = self._libc.inotify_add_watch(self.fd, path, mask)
+        if wd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_add_watch failed")
+        return wd
+
+
+    def close(self):
+        os.close(self.fd)
+
+
+    def read(self, timeout):
+        """Wait up to timeout seconds for events; returns a list of
+        (watch descriptor, name)."""
+        ready = select.select([ self.fd ], [], [], timeout)[0]
+        if not ready:
+            return []
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except OSError:
+            return []
+        events = []
+        pos = 0
+        while pos + _EVENT.size <= len(data):
+            wd, mask, cookie, nameLen = _EVENT.unpack_from(data, pos)
+            pos += _EVENT.size
+            name = data[pos:pos + nameLen].rstrip(b'\0')
+            pos += nameLen
+            events.append((wd, name.decode('utf-8', 'replace')))
+        return events
+
+
+
+class ConfigWatcher(object):
+    """Watches the files merged by name into a pyglet_piss.Config, and
+    reloads them when they change.
+
+    Changed files are parsed on a background thread, using inotify where
+    available and otherwise checking each file's modification time every
+    interval seconds.  Nothing touches the config until apply(), which
+    Application calls at the start of each frame; it swaps in at most
+    maxPerFrame parsed files (see Config.reload()), so the cost on the
+    render thread is bounded by the size of the changed files, and costs
+    nothing while they are unchanged.  Config subscribers are then told
+    which keys changed.
+
+    With inotify, a file is only read once the writer closes it (or once
+    it is renamed into place), so it is never caught half-written.  Polling
+    can read a file mid-write; a partial INI file usually parses, so its
+    missing keys are briefly reported as DELETED, until the next check
+    reads the finished file.  Files that fail to parse are skipped (see
+    lastError), and picked up again when next written.
+    """
+
+    def __init__(self, config, interval = 1.0, useInotify = True):
+        self.config = config
+        self.interval = interval
+        self.interval_doc = """Seconds between checks when polling, and the
+                longest wait before stop() takes effect"""
+        self.useInotify = useInotify
+        self.maxPerFrame = 1
+        self.maxPerFrame_doc = """Most reloaded files applied by one call to
+                apply()"""
+        self.reloads = 0
+        self.reloads_doc = """Number of files applied to the config"""
+        self.lastError = None
+        self.lastError_doc = """The exception from the last file that could
+                not be loaded, if any"""
+        self.usingInotify = False
+        self.usingInotify_doc = """True if the running watcher thread uses
+                inotify rather than polling"""
+        self._lock = threading.Lock()
+        self._pending = {}
+        self._pending_doc = """{ fname: parsed contents } waiting for
+                apply(); a later change to a file replaces its entry"""
+        self._stop = threading.Event()
+        self._thread = None
+
+
+    def apply(self):
+        """Apply up to maxPerFrame reloaded files to the config.  Call only
+        from the main thread.  Returns the number applied."""
+        if not self._pending:
+            return 0
+        with self._lock:
+            fnames = sorted(self._pending)[:self.maxPerFrame]
+            loaded = [ (f, self._pending.pop(f)) for f in fnames ]
+        applied = 0
+        for fname, data in loaded:
+            try:
+                self.config.reload(fname, data)
+            except KeyError:
+                # Unmerged since it was loaded
+                continue
+            applied += 1
+        self.reloads += applied
+        return applied
+
+
+    def start(self):
+        """Start watching the config's files on a background thread."""
+        self.stop()
+        self._stop.clear()
+        self._thread = threading.Thread(target = self._threadMain,
+                name = 'pyglet_piss config watcher')
+        self._thread.daemon = True
+        self._thread.start()
+
+
+    def stop(self):
+        """Stop watching; changes not yet applied are dropped."""
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+        with self._lock:
+            self._pending.clear()
+
+
+    def _load(self, fname):
+        try:
+            data = loadIni(fname, self.config.snapshots)
+        except Exception as e:
+            self.lastError = e
+            return
+        with self._lock:
+            self._pending[fname] = data
+
+
+    def _stat(self, fname):
+        try:
+            st = os.stat(fname)
+        except OSError:
+            return None
+        return (st.st_mtime, st.st_size)
+
+
+    def _threadMain(self):
+        inotify = None
+        if self.useInotify:
+            try:
+                inotify = _Inotify()
+            except (OSError, AttributeError):
+                inotify = None
+        self.usingInotify = inotify is not None
+        try:
+            if inotify is not None:
+                self._watchInotify(inotify)
+            else:
+                self._watchPolling()
+        finally:
+            if inotify is not None:
+                inotify.close()
+
+
+    def _watchInotify(self, inotify):
+        # Watch directories rather than files, since editors often save by
+        # writing a new file and renaming it over the old one
+        byDir = {}
+        for fname in self.config.mergedFiles:
+            path = os.path.abspath(fname)
+            byDir.setdefault(os.path.dirname(path), {})[
+                    os.path.basename(path)] = fname
+        byWatch = {}
+        for d, names in six.iteritems(byDir):
+            try:
+                byWatch[inotify.addWatch(d)] = names
+            except OSError:
+                continue
+        while not self._stop.is_set():
+            changed = set()
+            for wd, name in inotify.read(self.interval):
+                fname = byWatch.get(wd, {}).get(name)
+                if fname is not None:
+                    changed.add(fname)
+            for fname in changed:
+                self._load(fname)
+
+
+    def _watchPolling(self):
+        stats = dict([ (f, self._stat(f)) for f in self.config.mergedFiles ])
+        while not self._stop.wait(self.interval):
+            for fname, old in list(six.iteritems(stats)):
+                st = self._stat(fname)
+                if st != old:
+                    stats[fname] = st
+                    if st is not None:
+                        self._load(fname)